@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+""" Пакетный анализ строк планирования на матрицах numpy
+
+Вместо объекта Record для каждой строки все строки загружаются в плотные массивы: матрицу несостыковок
+(недели x строки) и плоскую таблицу заказов, отсортированную по строке, неделе и ключу заказа. Пакетно
+обрабатываются строки с положительными целыми заказами, на которых Record не выдает ошибку.
+
+Заказы строки выкладываются в одну очередь двигателей (по неделям, внутри недели - по ключам). Неделя i с
+опережением графика забирает двигатели из очереди, начиная с первого незабранного двигателя после недели i: часть
+двигателей недели i уже забрана предыдущими неделями, поэтому с учетом отставания c, перенесенного с недели i - 1,
+неделя забирает e[i] = d[i] + (забрано из недели i) + c двигателей. Отрезки очереди, забранные всеми неделями, находятся
+за один проход по неделям сразу для всех строк, а переносы влево (Record.move_left) - пересечения этих отрезков с
+отрезками заказов, их можно найти сразу для всех строк через searchsorted.
+
+Неделя с отставанием (e[i] < 0) отдает на следующую неделю -e[i] двигателей с наибольшими ключами из остатков своих
+заказов и двигателей, пришедших с предыдущей недели (Record.move_right). Такие переносы обрабатываются вторым проходом
+по неделям: на каждой неделе сразу для всех строк сортируются остатки и пришедшие части заказов, а записи журналов
+переносов (см. _Ledger) создаются, продолжаются и делятся так же, как в Record.mark_transition.
+
+Остальные строки (нецелые или неположительные заказы, ошибки во входных данных) анализируются через Record.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# заказы для пакетного анализа (см. order_arrays)
+OrderArrays = namedtuple('OrderArrays', ['engines', 'bounds', 'weeks', 'k', 'num1', 'num2', 'plans', 'names',
+                                         'features'])
+
+# виды записей журнала (см. _Ledger): без разделения, с разделением; NATIVE - остаток заказа на своей неделе
+WITHOUT, WITH, NATIVE = 0, 1, -1
+
+
+def order_arrays(order_df, index_date) -> OrderArrays:
+    """ Заказы таблицы заказов в массивах numpy для пакетного анализа
+
+    Строятся один раз вместе с индексом заказов (см. main.make_tables), чтобы plan_batch не проходил по всей таблице
+    заказов при каждом вызове. Заказы сгруппированы по деталям в порядке таблицы: заказы детали engines[i] - элементы
+    bounds[i]:bounds[i + 1] остальных массивов. weeks - индекс недели (-1, если даты нет в index_date), k - как в
+    ключе заказа (см. main.get_order_index), plans - None, если План не целочисленный.
+
+    :param order_df: таблица заказов со столбцами datetime, num1, num2 (см. main.read_tables)
+    :param index_date: соответсвие дат индексам недель
+    """
+    engine_codes, engine_values = pd.factorize(order_df['Id_125'], use_na_sentinel=False)
+    by_engine = np.argsort(engine_codes, kind='stable')
+    bounds = np.searchsorted(engine_codes[by_engine], np.arange(len(engine_values) + 1))
+    k = 10000 - (np.arange(len(by_engine)) - bounds[engine_codes[by_engine]])
+    weeks = np.array([index_date.get(date, -1) for date in order_df['datetime'].tolist()], dtype=np.int64)
+    plans = None
+    if pd.api.types.is_integer_dtype(order_df['План']):
+        plans = order_df['План'].to_numpy(dtype=np.int64)[by_engine]
+    return OrderArrays(pd.Index(engine_values), bounds, weeks[by_engine], k, order_df['num1'].to_numpy()[by_engine],
+                       order_df['num2'].to_numpy()[by_engine], plans,
+                       order_df['Заказ'].to_numpy(dtype=object)[by_engine],
+                       order_df['вн/внутр'].to_numpy(dtype=object)[by_engine])
+
+
+def plan_batch(engine_ids: list, differences, orders: OrderArrays, calendar):
+    """ Пакетный анализ строк планирования
+
+    :param engine_ids: ID_125 строк планирования
+    :param differences: матрица несостыковок этих строк (см. main.get_differences)
+    :param orders: заказы (см. order_arrays), построенные по index_date того же календаря
+    :param calendar: календарь недель (см. main.Calendar)
+    :return: массив признаков "строка обработана" и словарь {номер строки: (записи таблицы без разделения,
+             записи таблицы с разделением)} для обработанных строк, в которых есть переносы. Записи - кортежи в порядке
+             столбцов main.TRANSFER_COLUMNS и main.SEPARATION_COLUMNS, совпадают с результатом main.get_record
+    """
+    if not len(engine_ids):
+        return np.zeros(0, dtype=bool), {}
+    d = np.asarray(differences, dtype=np.int64)
+    n_parts, n_weeks = d.shape
+
+    # заказы строк планирования (ID_125 может повторяться в таблице планирования): row - номер заказа в orders
+    part_codes = orders.engines.get_indexer(list(engine_ids))
+    first = np.where(part_codes >= 0, orders.bounds[part_codes], 0)
+    counts = np.where(part_codes >= 0, orders.bounds[part_codes + 1] - first, 0)
+    part = np.repeat(np.arange(n_parts), counts)
+    row = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # строки, заказы которых нельзя обработать пакетно: даты нет в таблице дат (ошибку выдаст Record),
+    # нецелые или неположительные количества
+    missing_date = np.zeros(n_parts, dtype=bool)
+    missing_date[part[orders.weeks[row] < 0]] = True
+    plan = orders.plans
+    if plan is not None:
+        unsupported = missing_date.copy()
+        unsupported[part[plan[row] <= 0]] = True
+    else:
+        unsupported = np.ones(n_parts, dtype=bool)
+
+    no_differences = ~d.any(axis=1)
+    processed = no_differences & ~missing_date
+    candidates = ~no_differences & ~unsupported
+    if not candidates.any():
+        return processed, {}
+
+    selected = candidates[part]
+    part, row = part[selected], row[selected]
+    week = orders.weeks[row]
+    quantity = plan[row]
+
+    # дальше матрицы хранятся по неделям (недели x строки), чтобы проход по неделям читал непрерывные строки
+    d = np.ascontiguousarray(d.T)
+    o = np.zeros((n_weeks, n_parts), dtype=np.int64)
+    np.add.at(o, (week, part), quantity)
+    week_end = np.cumsum(o, axis=0)     # конец недели в очереди двигателей строки
+    week_start = week_end - o
+    total = week_end[-1]
+
+    # проход по неделям сразу для всех строк: pointer - начало еще не забранной переносами влево части очереди,
+    # carry - отставание, перенесенное с предыдущей недели. Строки, на которых Record выдает ошибку (сумма
+    # несостыковок, отставание больше заказов недели, перенос за последнюю неделю), остаются для Record
+    processable = candidates & (d.sum(axis=0) == 0) & ~((d < 0) & (-d > o)).any(axis=0)
+    pointer = np.zeros(n_parts, dtype=np.int64)
+    carry = np.zeros(n_parts, dtype=np.int64)
+    e = np.empty((n_weeks, n_parts), dtype=np.int64)           # > 0 - забрано влево, < 0 - перенесено вправо
+    pull_end = np.empty((n_weeks, n_parts), dtype=np.int64)    # конец забранного влево отрезка очереди
+    for i in range(n_weeks):
+        e[i] = d[i] + np.clip(pointer - week_start[i], 0, o[i]) + carry
+        pointer = np.where(e[i] > 0, np.maximum(pointer, week_end[i]) + e[i], pointer)
+        pull_end[i] = pointer
+        carry = np.minimum(e[i], 0)
+    processable &= (pointer <= total) & (carry == 0)
+    processed |= processable
+    if not processable.any():
+        return processed, {}
+
+    # очередь двигателей: заказы обработанных строк по строкам, неделям и ключам, позиции сквозные для всех строк
+    selected = processable[part]
+    part, week, row, quantity = part[selected], week[selected], row[selected], quantity[selected]
+    code = np.empty(len(part), dtype=np.int64)     # порядок ключей заказов внутри строки
+    code[np.lexsort((orders.k[row], orders.num2[row], orders.num1[row], part))] = \
+        np.arange(len(part))
+    order = np.argsort((part * n_weeks + week) * len(part) + code, kind='stable')
+    part, week, row, quantity, code = part[order], week[order], row[order], quantity[order], code[order]
+    offset = np.concatenate([[0], np.cumsum(np.where(processable, total, 0))[:-1]])
+    order_end = np.cumsum(quantity)
+    order_start = order_end - quantity
+
+    # переносы влево - пересечения забранных отрезков очереди с отрезками заказов
+    segment_week, segment_part = np.nonzero(processable & (e > 0))
+    segment_end = pull_end[segment_week, segment_part] + offset[segment_part]
+    segment_start = segment_end - e[segment_week, segment_part]
+    first = np.searchsorted(order_end, segment_start, side='right')
+    last = np.searchsorted(order_start, segment_end, side='left') - 1
+    counts = last - first + 1
+    segment = np.repeat(np.arange(len(first)), counts)
+    moved = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    quality = np.minimum(segment_end[segment], order_end[moved]) - np.maximum(segment_start[segment],
+                                                                               order_start[moved])
+    # заказ, перенесенный влево целиком за один раз, попадает в таблицу без разделения
+    whole = (np.bincount(moved, minlength=len(quantity))[moved] == 1) & (quality == quantity[moved])
+    ledger = _Ledger(len(moved) + len(quantity))
+    ledger.add(order=moved, kind=np.where(whole, WITHOUT, WITH), amount=quality, week_from=week[moved],
+               week_to=segment_week[segment], time=segment_week[segment], seq=order_start[moved])
+    remaining = quantity.copy()     # остаток заказа на своей неделе после переносов влево
+    np.subtract.at(remaining, moved, quality)
+
+    # переносы вправо по неделям: неделя с отставанием отдает -e двигателей с наибольшими ключами из остатков своих
+    # заказов и двигателей, пришедших с предыдущей недели. Пришедшая часть заказа продолжает свою запись журнала
+    by_week = np.argsort(week, kind='stable')
+    week_bounds = np.searchsorted(week[by_week], np.arange(n_weeks + 1))
+    arrived_order = arrived_amount = arrived_row = np.zeros(0, dtype=np.int64)
+    for i in range(n_weeks - 1):
+        carrying = processable & (e[i] < 0)
+        if not carrying.any():
+            arrived_order = arrived_amount = arrived_row = np.zeros(0, dtype=np.int64)
+            continue
+        native = by_week[week_bounds[i]:week_bounds[i + 1]]
+        native = native[carrying[part[native]] & (remaining[native] > 0)]
+        stay = carrying[part[arrived_order]]
+        c_order = np.concatenate([native, arrived_order[stay]])
+        c_amount = np.concatenate([remaining[native], arrived_amount[stay]])
+        c_row = np.concatenate([np.full(len(native), -1, dtype=np.int64), arrived_row[stay]])
+        s = np.lexsort((-code[c_order], part[c_order]))
+        c_order, c_amount, c_row = c_order[s], c_amount[s], c_row[s]
+        c_part = part[c_order]
+        c_end = np.cumsum(c_amount)
+        c_start = c_end - c_amount
+        group = np.concatenate([[True], c_part[1:] != c_part[:-1]])
+        c_start -= c_start[group][np.cumsum(group) - 1]
+        taken = np.clip(-e[i, c_part] - c_start, 0, c_amount)
+        m = taken > 0
+        c_order, c_amount, c_row, taken = c_order[m], c_amount[m], c_row[m], taken[m]
+        seq = 2 * np.arange(len(c_order))
+        kind = np.where(c_row < 0, NATIVE, ledger.kind[np.maximum(c_row, 0)])
+        whole = taken == c_amount
+        current = c_row.copy()
+
+        # весь остаток заказа или пришедшая часть из таблицы с разделением - новая запись без разделения
+        new = whole & (kind != WITHOUT)
+        current[new] = ledger.add(order=c_order[new], kind=WITHOUT, amount=quantity[c_order[new]], week_from=i,
+                                  week_to=i + 1, time=i, seq=seq[new])
+        # пришедшая целиком запись без разделения переносится дальше
+        ledger.week_to[c_row[whole & (kind == WITHOUT)]] = i + 1
+        # часть остатка заказа
+        new = ~whole & (kind == NATIVE)
+        current[new] = ledger.add(order=c_order[new], kind=WITH, amount=taken[new], week_from=i, week_to=i + 1,
+                                  time=i, seq=seq[new])
+        # часть записи без разделения: запись делится на две записи с разделением
+        split = ~whole & (kind == WITHOUT)
+        r = c_row[split]
+        ledger.alive[r] = 0
+        ledger.add(order=c_order[split], kind=WITH, amount=quantity[c_order[split]] - taken[split],
+                   week_from=ledger.week_from[r], week_to=i, time=i, seq=seq[split])
+        current[split] = ledger.add(order=c_order[split], kind=WITH, amount=taken[split],
+                                    week_from=ledger.week_from[r], week_to=i + 1, time=i, seq=seq[split] + 1)
+        # часть записи с разделением: остаток записи остается на неделе
+        split = ~whole & (kind == WITH)
+        r = c_row[split]
+        ledger.amount[r] -= taken[split]
+        current[split] = ledger.add(order=c_order[split], kind=WITH, amount=taken[split],
+                                    week_from=ledger.week_from[r], week_to=i + 1, time=i, seq=seq[split])
+        arrived_order, arrived_amount, arrived_row = c_order, taken, current
+
+    # порядок записей как у Record: по строкам, неделям анализа и порядку переносов на неделе
+    rows = np.flatnonzero(ledger.alive[:ledger.size])
+    moved = ledger.order[rows]
+    rows = rows[np.lexsort((ledger.seq[rows], ledger.time[rows], part[moved]))]
+    moved = ledger.order[rows]
+
+    dates = np.array(calendar.dates, dtype=object)
+    engine_ids = np.array(list(engine_ids), dtype=object)
+    names = orders.names
+    features = orders.features
+
+    # записи обеих таблиц собираются целиком и затем делятся по строкам (записи упорядочены по строкам)
+    kind = ledger.kind[rows]
+    r = rows[kind == WITHOUT]
+    m = ledger.order[r]
+    transfers = list(zip(engine_ids[part[m]].tolist(), quantity[m].tolist(), features[row[m]].tolist(),
+                         names[row[m]].tolist(), dates[ledger.week_from[r]].tolist(),
+                         dates[ledger.week_to[r]].tolist()))
+    transfer_part = part[m]
+    r = rows[kind == WITH]
+    m = ledger.order[r]
+    separations = list(zip(engine_ids[part[m]].tolist(), names[row[m]].tolist(), quantity[m].tolist(),
+                           dates[ledger.week_from[r]].tolist(), ledger.amount[r].tolist(),
+                           dates[ledger.week_to[r]].tolist()))
+    separation_part = part[m]
+
+    moved_parts = np.unique(part[moved])
+    bounds = zip(moved_parts.tolist(),
+                 np.searchsorted(transfer_part, moved_parts, side='left').tolist(),
+                 np.searchsorted(transfer_part, moved_parts, side='right').tolist(),
+                 np.searchsorted(separation_part, moved_parts, side='left').tolist(),
+                 np.searchsorted(separation_part, moved_parts, side='right').tolist())
+    results = {p: (transfers[a:b], separations[c:e]) for p, a, b, c, e in bounds}
+    return processed, results
+
+
+class _Ledger:
+    """ Записи журналов переносов всех строк (см. main.Record.mark_transition) в массивах numpy
+
+    order - номер заказа в очереди, kind - таблица (WITHOUT или WITH), amount - количество (для таблицы без
+    разделения - весь заказ), week_from/week_to - недели "Дата кон." и "d+", time/seq - неделя анализа и порядок
+    записи на ней (по ним восстанавливается порядок записей Record), alive - запись не удалена.
+    """
+    FIELDS = ('order', 'kind', 'amount', 'week_from', 'week_to', 'time', 'seq', 'alive')
+
+    def __init__(self, capacity: int):
+        self.size = 0
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(max(capacity, 16), dtype=np.int64))
+
+    def add(self, **values) -> np.ndarray:
+        """ Добавление записей: значения - массивы одной длины или числа
+
+        :return: номера добавленных записей
+        """
+        n = len(values['order'])
+        if self.size + n > len(self.order):
+            capacity = max(2 * len(self.order), self.size + n)
+            for name in self.FIELDS:
+                column = np.zeros(capacity, dtype=np.int64)
+                column[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, column)
+        ids = np.arange(self.size, self.size + n)
+        for name, value in values.items():
+            getattr(self, name)[ids] = value
+        self.alive[ids] = 1
+        self.size += n
+        return ids
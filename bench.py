@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+""" Замеры времени основных этапов на синтетических данных (см. generate.py)
+
+Для каждого масштаба генерируется рабочая книга, после чего отдельно замеряются get_tables, анализ всех строк
+планирования (get_record), split_into_iterations и write_to_file. Результаты записываются в json файл, который
+можно сравнить с результатами предыдущего запуска (--compare).
+
+Пример:
+    python bench.py --scales 1000:5:26,5000:5:52 --output bench_results.json --compare old_results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import generate
+import main as planner
+
+DEFAULT_SCALES = '1000:5:26,5000:5:52,20000:5:52'
+
+
+def parse_scales(text):
+    """ Масштабы вида "детали:заказов на деталь:недели[:drift]" через запятую"""
+    scales = []
+    for item in text.split(','):
+        values = item.strip().split(':')
+        parts, orders, weeks = (int(v) for v in values[:3])
+        drift = float(values[3]) if len(values) > 3 else 0.2
+        scales.append({'parts': parts, 'orders_per_part': orders, 'weeks': weeks, 'drift': drift})
+    return scales
+
+
+def run_scale(scale, workdir, seed=0, repeat=1, engine='record'):
+    """ Замер этапов для одного масштаба
+
+    :return: словарь с параметрами масштаба, лучшим временем каждого этапа (в секундах) и объемом результата
+    """
+    name = '{parts}_{orders_per_part}_{weeks}'.format(**scale)
+    filepath = os.path.join(workdir, f'{name}.xlsx')
+    conf_file = os.path.join(workdir, f'{name}.ini')
+    tables = generate.generate_tables(scale['parts'], scale['orders_per_part'], scale['weeks'], scale['drift'], seed)
+    generate.write_workbook(filepath, *tables)
+    generate.write_config(conf_file, filepath, os.path.join(workdir, f'{name}_result.xlsx'))
+
+    timings = {}
+
+    def measure(stage, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[stage] = best
+        return result
+
+    tables = measure('get_tables', lambda: planner.get_tables(conf_file))
+    records = measure('get_record', lambda: list(planner.plan_records(tables, 1, conf_file, engine=engine)))
+    result_table = pd.DataFrame([row for r in records for row in r[0]], columns=planner.TRANSFER_COLUMNS)
+    result_table_with_separation = pd.DataFrame([row for r in records for row in r[1]],
+                                                columns=planner.SEPARATION_COLUMNS)
+    measure('split_into_iterations',
+            lambda: planner.split_into_iterations(result_table_with_separation, tables.order_type))
+    measure('write_to_file', lambda: planner.write_to_file(result_table, result_table_with_separation,
+                                                           tables.order_type, conf_file))
+    return dict(scale, orders=len(tables.order_df), transfers=len(result_table),
+                separated_transfers=len(result_table_with_separation), seconds=timings)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, previous):
+    """ Вывод отношения времени этапов к предыдущему запуску (> 1 - стало медленнее)"""
+    old = {(r['parts'], r['orders_per_part'], r['weeks'], r['drift']): r for r in previous['results']}
+    for result in results:
+        key = (result['parts'], result['orders_per_part'], result['weeks'], result['drift'])
+        if key not in old:
+            continue
+        ratios = ', '.join(f"{stage} x{seconds / old[key]['seconds'][stage]:.2f}"
+                           for stage, seconds in result['seconds'].items()
+                           if old[key]['seconds'].get(stage))
+        print(f"{key}: {ratios}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры времени основных этапов на синтетических данных')
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help='масштабы вида "детали:заказов на деталь:недели[:drift]" через запятую')
+    parser.add_argument('--repeat', type=int, default=1, help='количество повторов каждого этапа (берется лучшее)')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора данных')
+    parser.add_argument('--engine', default='record', choices=planner.ENGINES, help='способ анализа строк')
+    parser.add_argument('--output', default='bench_results.json', help='файл для записи результатов')
+    parser.add_argument('--compare', default=None, help='файл результатов предыдущего запуска для сравнения')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in parse_scales(args.scales):
+            result = run_scale(scale, workdir, args.seed, args.repeat, args.engine)
+            print(json.dumps(result, ensure_ascii=False))
+            results.append(result)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'engine': args.engine,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
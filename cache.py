@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" Кэш разобранных рабочих книг на диске
+
+Разбор большого xls файла - самая долгая часть запуска, а планировщики запускают программу много раз на одном и
+том же файле. Поэтому нормализованные таблицы сохраняются в каталог кэша (в бинарном виде - pickle) под ключом,
+который зависит от содержимого файла и имен вкладок из конфиг файла: при изменении файла или конфига ключ меняется
+и старая запись просто перестает использоваться. Размер каталога ограничен, при превышении удаляются записи,
+которые дольше всего не читались.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+# версия формата записей - увеличивается при изменении нормализации таблиц
+CACHE_VERSION = 3
+SUFFIX = '.pkl'
+
+
+def file_hash(filepath, block_size=1 << 20) -> str:
+    """ sha256 содержимого файла"""
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(filepath, *parts) -> str:
+    """ Ключ записи кэша: содержимое файла (или списка файлов) + дополнительные параметры (например, имена вкладок)"""
+    filepaths = [filepath] if isinstance(filepath, str) else filepath
+    h = hashlib.sha256(f'{CACHE_VERSION}:{":".join(file_hash(path) for path in filepaths)}'.encode('utf8'))
+    for part in parts:
+        h.update(b'\0' + str(part).encode('utf8'))
+    return h.hexdigest()
+
+
+def load(cache_dir, key):
+    """ Чтение записи кэша
+
+    :return: сохраненное значение или None, если записи нет (или она повреждена)
+    """
+    path = os.path.join(cache_dir, key + SUFFIX)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # поврежденная или несовместимая запись - удаляем и читаем файл заново
+        _remove(path)
+        return None
+    # время последнего обращения - для вытеснения давно не используемых записей
+    os.utime(path)
+    return value
+
+
+def save(cache_dir, key, value, max_size: int):
+    """ Запись в кэш с последующим вытеснением старых записей
+
+    :param cache_dir: каталог кэша
+    :param key: ключ записи (см. cache_key)
+    :param value: сохраняемое значение
+    :param max_size: максимальный суммарный размер записей в байтах
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(cache_dir, key + SUFFIX))
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size: int):
+    """ Удаление записей, которые дольше всего не читались, пока суммарный размер больше max_size"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(SUFFIX) and entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        _remove(path)
+        total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+""" Генератор синтетических входных данных
+
+Создает рабочую книгу того же вида, что ожидает get_tables: вкладку заказов (две строки заголовка сверху),
+вкладку графика и плана (одна строка заголовка сверху) и вкладку дат. План (Pl*) каждой детали - это сумма ее
+заказов по неделям, а график (Gr*) получается из плана сдвигом части двигателей на несколько недель раньше или
+позже (параметр drift). Книга записывается в формате xlsx, для ее чтения pandas нужен openpyxl.
+
+Пример:
+    python generate.py --parts 20000 --orders 5 --weeks 52 --drift 0.2 -o 20k.xlsx --config 20k.ini
+"""
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+ORDER_SHEET = 'дано'
+SCHEDULE_SHEET = 'ориг'
+DATE_SHEET = 'Лист0'
+
+
+def generate_tables(parts=1000, orders_per_part=5, weeks=26, drift=0.2, seed=0, start_week=1,
+                    start_date=datetime.date(2019, 1, 4)):
+    """ Генерация таблиц заказов, планирования и дат
+
+    :param parts: количество деталей (строк планирования)
+    :param orders_per_part: среднее количество заказов на деталь
+    :param weeks: количество недель
+    :param drift: доля двигателей, которые в графике сдвинуты относительно плана (0 - график совпадает с планом)
+    :param seed: зерно генератора случайных чисел
+    :param start_week: номер первой недели
+    :param start_date: дата (пятница) первой недели
+    :return: order_df, schedule_df, date_df в том виде, в котором они лежат на вкладках
+    """
+    if weeks < 2:
+        raise Exception("Количество недель должно быть не меньше 2.")
+    rng = np.random.default_rng(seed)
+    week_numbers = np.arange(start_week, start_week + weeks)
+    dates = [datetime.datetime.combine(start_date + datetime.timedelta(weeks=i), datetime.time())
+             for i in range(weeks)]
+    date_df = pd.DataFrame({'т': week_numbers, 'тт': dates})
+
+    # заказы: у каждой детали от 1 до 2 * orders_per_part - 1 заказов
+    engine_ids = np.arange(1, parts + 1) * 10 + 125000
+    counts = rng.integers(1, max(2 * orders_per_part, 2), size=parts)
+    order_part = np.repeat(np.arange(parts), counts)
+    n = len(order_part)
+    order_week = rng.integers(0, weeks, size=n)
+    quantity = rng.integers(1, 21, size=n)
+    num1 = rng.integers(1, 1000, size=n)
+    num2 = rng.integers(1, 100, size=n)
+    series = rng.choice(np.array(['А', 'Б', 'ВК', 'ГР']), size=n)
+    names = [f'{a}*-{s}{b % 7}-{b}' for a, s, b in zip(num1.tolist(), series.tolist(), num2.tolist())]
+    features = rng.choice(np.array(['внешний', 'внутр']), size=n)
+    order_df = pd.DataFrame({
+        'Id_125': engine_ids[order_part],
+        'Наименование': [f'Деталь {i}' for i in engine_ids[order_part].tolist()],
+        'План': quantity,
+        'вн/внутр': features,
+        'Заказ': names,
+        'Дата кон.': [dates[w] for w in order_week.tolist()],
+    })
+
+    # план - сумма заказов по неделям
+    plan = np.zeros((parts, weeks), dtype=np.int64)
+    np.add.at(plan, (order_part, order_week), quantity)
+
+    # график - часть двигателей каждой недели сдвинута на 1-3 недели. Сдвиг позже последней недели невозможен,
+    # поэтому такие двигатели попадают на предпоследнюю неделю
+    moved = rng.binomial(plan, drift)
+    shift = rng.choice(np.array([-3, -2, -1, 1, 2, 3]), size=plan.shape)
+    target = np.arange(weeks)[None, :] + shift
+    target = np.where(shift > 0, np.minimum(target, weeks - 2), np.maximum(target, 0))
+    schedule = plan - moved
+    np.add.at(schedule, (np.broadcast_to(np.arange(parts)[:, None], plan.shape), target), moved)
+
+    columns = {'ID_125': engine_ids}
+    for i, week in enumerate(week_numbers.tolist()):
+        columns[f'Gr{week}'] = np.where(schedule[:, i] > 0, schedule[:, i], np.nan)
+        columns[f'Pl{week}'] = np.where(plan[:, i] > 0, plan[:, i], np.nan)
+    schedule_df = pd.DataFrame(columns)
+    return order_df, schedule_df, date_df
+
+
+def write_workbook(filepath, order_df, schedule_df, date_df):
+    """ Запись таблиц в рабочую книгу со строками заголовка над таблицами, как в исходных файлах"""
+    with pd.ExcelWriter(filepath, engine='xlsxwriter', datetime_format='dd.mm.yyyy') as writer:
+        order_df.to_excel(writer, sheet_name=ORDER_SHEET, startrow=2, index=False)
+        writer.sheets[ORDER_SHEET].write(0, 0, 'Заказы (сгенерировано generate.py)')
+        schedule_df.to_excel(writer, sheet_name=SCHEDULE_SHEET, startrow=1, index=False)
+        writer.sheets[SCHEDULE_SHEET].write(0, 0, 'График и план (сгенерировано generate.py)')
+        date_df.to_excel(writer, sheet_name=DATE_SHEET, index=False)
+
+
+def write_config(conf_file, filepath, result_filepath, **options):
+    """ Запись конфиг файла для сгенерированной книги
+
+    :param options: дополнительные ключи секции DEFAULT (например, workers='4')
+    """
+    lines = ['[DEFAULT]',
+             f'filepath = {filepath}',
+             f'order_sheet = {ORDER_SHEET}',
+             f'schedule_sheet = {SCHEDULE_SHEET}',
+             f'date_sheet = {DATE_SHEET}',
+             f'result_filepath = {result_filepath}',
+             'result_sheet = res',
+             'result_separation_sheet = res_separ']
+    lines += [f'{key} = {value}' for key, value in options.items()]
+    with open(conf_file, 'w', encoding='utf8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Генерация синтетической рабочей книги')
+    parser.add_argument('--parts', type=int, default=1000, help='количество деталей')
+    parser.add_argument('--orders', type=int, default=5, help='среднее количество заказов на деталь')
+    parser.add_argument('--weeks', type=int, default=26, help='количество недель')
+    parser.add_argument('--drift', type=float, default=0.2, help='доля двигателей, сдвинутых в графике')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора случайных чисел')
+    parser.add_argument('-o', '--output', default='generated.xlsx', help='имя создаваемой книги')
+    parser.add_argument('--config', default=None, help='имя создаваемого конфиг файла (по умолчанию не создается)')
+    parser.add_argument('--result', default='generated_result.xlsx', help='result_filepath для конфиг файла')
+    args = parser.parse_args(argv)
+
+    tables = generate_tables(args.parts, args.orders, args.weeks, args.drift, args.seed)
+    write_workbook(args.output, *tables)
+    if args.config:
+        write_config(args.config, args.output, args.result)
+
+
+if __name__ == "__main__":
+    main()
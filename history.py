@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+""" История переносов в базе SQLite
+
+Если задан файл истории (ключ history_filepath конфиг файла или python main.py --history <файл>), то после записи
+результата все переносы запуска сохраняются в базу: таблица runs - запуски, таблица transfers - переносы (вид
+переноса, ID_125, заказ, сколько двигателей в заказе и сколько перенесено, откуда и куда). Во время анализа строки
+копятся во временном файле (см. writers.SheetSpool) и вставляются в базу одной транзакцией в конце, поэтому
+база не блокируется на время анализа, а запуск, завершившийся ошибкой, в историю не попадает.
+
+Переносы проиндексированы по ID_125, заказу, запуску и датам, поэтому история заказа или сравнение двух запусков
+не просматривают всю таблицу. Запросы:
+    python history.py runs --db history.sqlite                         - последние запуски
+    python history.py history --db history.sqlite --part 1234 --last 20  - куда переносились заказы детали
+    python history.py history --db history.sqlite --order <заказ>      - история заказа по всем деталям
+    python history.py diff --db history.sqlite [<запуск> <запуск>]     - чем отличаются запуски (по умолчанию -
+                                                                         два последних)
+Ключ -o <файл.csv> дополнительно записывает результат запроса в csv.
+"""
+import argparse
+import datetime
+import sqlite3
+
+import pandas as pd
+
+import writers
+
+# вид переноса: заказ целиком (таблица res) или часть заказа (таблица res_separ)
+WHOLE, PART = 0, 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT NOT NULL,
+    workbook TEXT,
+    result_filepath TEXT,
+    transfers INTEGER NOT NULL,
+    separations INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transfers (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    kind INTEGER NOT NULL,
+    id_125 TEXT NOT NULL,
+    order_name TEXT NOT NULL,
+    total INTEGER,
+    quantity INTEGER,
+    date_from TEXT,
+    date_to TEXT
+);
+CREATE INDEX IF NOT EXISTS transfers_part ON transfers (id_125, order_name, run_id);
+CREATE INDEX IF NOT EXISTS transfers_order ON transfers (order_name, run_id);
+CREATE INDEX IF NOT EXISTS transfers_run ON transfers (run_id, id_125, order_name);
+CREATE INDEX IF NOT EXISTS transfers_dates ON transfers (date_to, date_from);
+"""
+
+TRANSFER_FIELDS = ['kind', 'id_125', 'order_name', 'total', 'quantity', 'date_from', 'date_to']
+
+
+def connect(filepath, timeout=30) -> sqlite3.Connection:
+    """ Соединение с базой истории (база и таблицы создаются при первом обращении)"""
+    connection = sqlite3.connect(filepath, timeout=timeout)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _date(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+
+class HistoryRecorder:
+    """ Переносы одного запуска: копятся во временном файле и сохраняются в базу одной транзакцией (см. save)"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.started = datetime.datetime.now()
+        self.spool = writers.SheetSpool(TRANSFER_FIELDS)
+        self.transfers = 0
+        self.separations = 0
+
+    def add(self, transfers: list, separations: list):
+        """ Записи одной строки планирования (см. main.get_record_rows)"""
+        rows = [(WHOLE, str(engine_id), order_name, plan, plan, _date(date_from), _date(date_to))
+                for engine_id, plan, _, order_name, date_from, date_to in transfers]
+        rows += [(PART, str(engine_id), order_name, total, number, _date(date_from), _date(date_to))
+                 for engine_id, order_name, total, date_from, number, date_to in separations]
+        self.spool.write(rows)
+        self.transfers += len(transfers)
+        self.separations += len(separations)
+
+    def save(self, workbook='', result_filepath='') -> int:
+        """ Сохранение запуска в базу
+
+        :return: номер запуска (run_id)
+        """
+        connection = connect(self.filepath)
+        try:
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO runs (started, finished, workbook, result_filepath, transfers, separations) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.started.isoformat(timespec='seconds'),
+                     datetime.datetime.now().isoformat(timespec='seconds'), workbook, result_filepath,
+                     self.transfers, self.separations))
+                run_id = cursor.lastrowid
+                connection.executemany(
+                    f'INSERT INTO transfers (run_id, {", ".join(TRANSFER_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    ((run_id, ) + row for row in self.spool))
+        finally:
+            connection.close()
+            self.spool.close()
+        return run_id
+
+    def discard(self):
+        self.spool.close()
+
+
+def list_runs(filepath, last=20) -> pd.DataFrame:
+    """ Последние запуски (новые сверху)"""
+    connection = connect(filepath)
+    try:
+        return pd.read_sql_query('SELECT * FROM runs ORDER BY run_id DESC LIMIT ?', connection, params=(last, ))
+    finally:
+        connection.close()
+
+
+def transfer_history(filepath, engine_id=None, order_name=None, last=20) -> pd.DataFrame:
+    """ Переносы детали и/или заказа за последние last запусков
+
+    :param engine_id: ID_125 детали (None - любая деталь)
+    :param order_name: заказ (None - любой заказ детали)
+    :param last: сколько последних запусков просматривать
+    """
+    if engine_id is None and order_name is None:
+        raise Exception("Для истории переносов нужно указать деталь или заказ.")
+    conditions = ['t.run_id >= (SELECT COALESCE(MIN(run_id), 0) FROM '
+                  '(SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?))']
+    params = [last]
+    if engine_id is not None:
+        conditions.append('t.id_125 = ?')
+        params.append(str(engine_id))
+    if order_name is not None:
+        conditions.append('t.order_name = ?')
+        params.append(order_name)
+    connection = connect(filepath)
+    try:
+        return pd.read_sql_query(
+            f'SELECT t.run_id, r.started, t.id_125, t.order_name, t.kind, t.total, t.quantity, t.date_from, '
+            f't.date_to FROM transfers t JOIN runs r ON r.run_id = t.run_id WHERE {" AND ".join(conditions)} '
+            f'ORDER BY t.run_id, t.id_125, t.order_name, t.date_from, t.date_to', connection, params=params)
+    finally:
+        connection.close()
+
+
+def diff_runs(filepath, run_a=None, run_b=None) -> pd.DataFrame:
+    """ Отличия переносов двух запусков: change = '-' - перенос был только в run_a, '+' - только в run_b
+
+    По умолчанию сравниваются два последних запуска.
+    """
+    connection = connect(filepath)
+    try:
+        if run_a is None or run_b is None:
+            runs = [row[0] for row in connection.execute('SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 2')]
+            if len(runs) < 2:
+                raise Exception("Для сравнения в истории должно быть хотя бы два запуска.")
+            run_b, run_a = runs
+        fields = ', '.join(TRANSFER_FIELDS)
+        return pd.read_sql_query(
+            f"SELECT '-' AS change, * FROM (SELECT {fields} FROM transfers WHERE run_id = ? "
+            f"EXCEPT SELECT {fields} FROM transfers WHERE run_id = ?) "
+            f"UNION ALL "
+            f"SELECT '+' AS change, * FROM (SELECT {fields} FROM transfers WHERE run_id = ? "
+            f"EXCEPT SELECT {fields} FROM transfers WHERE run_id = ?) "
+            f"ORDER BY id_125, order_name, kind, date_from, date_to, change",
+            connection, params=(run_a, run_b, run_b, run_a))
+    finally:
+        connection.close()
+
+
+def parse_args(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', required=True, help="файл истории (history_filepath)")
+    common.add_argument('-o', '--output', default='', help="записать результат запроса в csv")
+    parser = argparse.ArgumentParser(description="Запросы к истории переносов")
+    commands = parser.add_subparsers(dest='command', required=True)
+    runs = commands.add_parser('runs', parents=[common], help="последние запуски")
+    runs.add_argument('--last', type=int, default=20)
+    history = commands.add_parser('history', parents=[common], help="переносы детали и/или заказа")
+    history.add_argument('--part', default=None, help="ID_125 детали")
+    history.add_argument('--order', default=None, help="заказ")
+    history.add_argument('--last', type=int, default=20, help="сколько последних запусков просматривать")
+    diff = commands.add_parser('diff', parents=[common], help="отличия двух запусков (по умолчанию - двух последних)")
+    diff.add_argument('runs', nargs='*', type=int, help="номера запусков: старый и новый")
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    if args.command == 'runs':
+        df = list_runs(args.db, args.last)
+    elif args.command == 'history':
+        df = transfer_history(args.db, args.part, args.order, args.last)
+    else:
+        if len(args.runs) not in (0, 2):
+            raise Exception("Для сравнения нужно указать два запуска или ни одного.")
+        df = diff_runs(args.db, *args.runs)
+    if args.output:
+        df.to_csv(args.output, index=False)
+    print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    run()
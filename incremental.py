@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+""" Состояние для инкрементального анализа
+
+Между двумя сеансами планирования обычно меняются строки графика или заказы лишь нескольких сотен деталей.
+Поэтому после каждого запуска для каждой строки планирования сохраняется "отпечаток" входных данных (строка
+несостыковок и заказы детали) вместе с результатом. При следующем запуске заново анализируются только строки,
+чей отпечаток изменился, а для остальных берется сохраненный результат.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+# версия состояния - увеличивается при изменении алгоритма анализа, чтобы старые результаты не использовались
+STATE_VERSION = 1
+
+
+def fingerprint(*parts) -> str:
+    """ Отпечаток входных данных (значения должны иметь детерминированное repr)"""
+    return hashlib.blake2b(repr(parts).encode('utf8'), digest_size=16).hexdigest()
+
+
+def part_keys(engine_ids) -> list:
+    """ Ключи строк планирования: (ID_125, номер повторения этого ID_125 в таблице)"""
+    seen = {}
+    keys = []
+    for engine_id in engine_ids:
+        seen[engine_id] = seen.get(engine_id, -1) + 1
+        keys.append((engine_id, seen[engine_id]))
+    return keys
+
+
+def load_state(filepath, salt: str) -> dict:
+    """ Результаты предыдущего запуска
+
+    :param filepath: файл состояния
+    :param salt: отпечаток общих для всех строк данных (например, таблицы дат). Если он изменился, то предыдущие
+                 результаты не используются
+    :return: словарь {ключ строки: (отпечаток, записи таблицы без разделения, записи таблицы с разделением)}
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return {}
+    if state.get('version') != STATE_VERSION or state.get('salt') != salt:
+        return {}
+    return state['parts']
+
+
+def save_state(filepath, salt: str, parts: dict):
+    """ Атомарная запись результатов (формат см. load_state)"""
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'version': STATE_VERSION, 'salt': salt, 'parts': parts}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
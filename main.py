@@ -1,66 +1,201 @@
 # -*- coding: utf-8 -*-
+import argparse
+import array
+import bisect
 import codecs
 import configparser
 import datetime
-from collections import OrderedDict
-
+import itertools
+import os
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+import batch
+import cache
+import history
+import incremental
+import metrics
+import readers
+import writers
+
+# способы анализа строк планирования (см. plan_records)
+ENGINES = ('record', 'batch')
+
+# столбцы результирующих таблиц: перенос заказа целиком и перенос части заказа
+TRANSFER_COLUMNS = ['Id_125', 'План', 'вн/внутр', 'Заказ', 'Дата кон.', 'd+']
+SEPARATION_COLUMNS = ['Id_125', 'Заказ', 'Всего в заказе', 'Дата кон.', 'План', 'd+']
+
+# заказы одной детали (см. get_order_index)
+PartOrders = namedtuple('PartOrders', ['weeks', 'plans', 'names', 'features', 'missing'])
+EMPTY_ORDERS = PartOrders(array.array('l'), array.array('q'), (), (), None)
+
+# подготовленные стартовые таблицы (результат get_tables)
+Tables = namedtuple('Tables', ['order_df', 'schedule_df', 'date_df', 'order_type', 'differences', 'calendar',
+                               'order_index', 'order_arrays'])
+
+
+# столбцы записи журнала переносов (см. TransferLedger)
+ORDER, PLAN, DATE_FROM, DATE_TO, TOTAL = range(5)
+
+
+class TransferLedger:
+    """ Журнал переносов (строки одной из результирующих таблиц)
+
+    Записи хранятся в порядке добавления, а индекс (код заказа, неделя d+) указывает на номера записей, поэтому
+    поиск, изменение, удаление и добавление записи не требуют просмотра всей таблицы. Запись - короткий список
+    [код заказа, План, неделя "Дата кон.", неделя "d+", Всего в заказе], недели хранятся индексами и превращаются в
+    даты только в строках результата (см. Record.transfer_rows).
+    """
+    __slots__ = ('rows', 'index', 'order_counts')
+
+    def __init__(self):
+        self.rows = []              # записи, на месте удаленных записей - None
+        self.index = {}             # (код заказа, неделя d+) -> номера записей по возрастанию
+        self.order_counts = {}      # код заказа -> количество записей с ним
+
+    def find(self, code: int, week: int) -> list:
+        """ номера записей данного заказа, перенесенного на неделю week"""
+        return list(self.index.get((code, week), []))
+
+    def contains_order(self, code: int) -> bool:
+        """ есть ли в журнале хоть одна запись с данным заказом"""
+        return code in self.order_counts
+
+    def insert(self, data: list):
+        """ добавление записи в конец журнала"""
+        self.rows.append(data)
+        self._link(len(self.rows) - 1)
+        self.order_counts[data[ORDER]] = self.order_counts.get(data[ORDER], 0) + 1
+
+    def update(self, row_numbers: list, column: int, value):
+        """ изменение значения столбца column у записей row_numbers"""
+        for n in row_numbers:
+            if column == DATE_TO:
+                self._unlink(n)
+                self.rows[n][column] = value
+                self._link(n)
+            else:
+                self.rows[n][column] = value
+
+    def delete(self, row_numbers: list):
+        """ удаление записей row_numbers"""
+        for n in row_numbers:
+            self._unlink(n)
+            code = self.rows[n][ORDER]
+            self.order_counts[code] -= 1
+            if not self.order_counts[code]:
+                del self.order_counts[code]
+            self.rows[n] = None
+
+    def _link(self, n: int):
+        row = self.rows[n]
+        bisect.insort(self.index.setdefault((row[ORDER], row[DATE_TO]), []), n)
+
+    def _unlink(self, n: int):
+        row = self.rows[n]
+        key = (row[ORDER], row[DATE_TO])
+        self.index[key].remove(n)
+        if not self.index[key]:
+            del self.index[key]
+
 
 class Record:
+    """ Нормализация одной строки планирования
+
+    Заказы детали пронумерованы в порядке возрастания ключей (num1, num2, k) - см. get_order_index, поэтому вместо
+    ключей используются их номера (коды). Для каждой недели хранятся количества по кодам (orders), коды в порядке
+    возрастания (order_keys) и сумма двигателей (totals). Коды остаются отсортированными при каждом перемещении
+    (вставка бинарным поиском), поэтому первый заказ недели всегда в начале списка, а последний - в конце, и
+    сортировать неделю заново после каждого переноса не нужно. Словари и списки создаются только для недель, на
+    которых есть заказы.
+    """
+    __slots__ = ('engine_id', 'differences', 'orders', 'order_keys', 'totals', 'next_week', 'index_date', 'plans',
+                 'names', 'moves', 'transfers_without_separation', 'transfers_with_separation')
 
-    def __init__(self, engine_id, differences: list, orders: list, index_date: dict, order_dict: dict):
+    def __init__(self, engine_id, differences: list, part_orders, index_date: dict):
+        """
+        :param engine_id: ID_125 детали
+        :param differences: строка несостыковок графика и плана
+        :param part_orders: заказы детали (PartOrders, см. get_order_index)
+        :param index_date: соответсвие индексов недель датам
+        """
         if sum(differences) != 0:
             raise Exception(f"Sum differences != 0: {differences}")
+        n = len(differences)
         self.engine_id = engine_id
         self.differences = differences
-        for i in range(len(differences)):
-            if differences[i] < 0 and -differences[i] > sum(orders[i].values()):
+        self.orders = [None] * n
+        self.order_keys = [None] * n
+        self.totals = [0] * n
+        for code, (week, quality) in enumerate(zip(part_orders.weeks, part_orders.plans)):
+            if self.orders[week] is None:
+                self.orders[week] = {}
+                self.order_keys[week] = []
+            self.orders[week][code] = quality
+            self.order_keys[week].append(code)
+            self.totals[week] += quality
+        for i in range(n):
+            if differences[i] < 0 and -differences[i] > self.totals[i]:
                 raise Exception(f"План расходится с заказом на детали {engine_id}.")
-        self.orders = [Record.sort_orders(week_order) for week_order in orders]
+        # следующая неделя с заказами: next_week[j] == j, если на неделе j есть заказы (см. find_week)
+        self.next_week = [j if self.order_keys[j] else j + 1 for j in range(n)] + [n]
         self.index_date = index_date    # соответсвие индекса массива определенной дате
-        self.order_dict = order_dict    # то , что было на старте:
-        self.move_to_future = {}
-
-        # табличка для логирования случаев, когда переносим весь заказ
-        columns = ['Id_125', 'План', 'вн/внутр', 'Заказ', 'Дата кон.', 'd+']
-        self.transfers_without_separation = pd.DataFrame(columns=columns)
-        # табличка для логирования случаев, когда переносим часть заказа
-        columns2 = ['Id_125', 'Заказ', 'Всего в заказе', 'Дата кон.', 'План', 'd+']
-        self.transfers_with_separation = pd.DataFrame(columns=columns2)
-
-    @staticmethod
-    def sort_orders(one_week_orders):
-        """ сортируем заказы на одну неделю в порядке возрастания двух номеров
-        """
-        keys = list(one_week_orders.keys())
-        keys.sort(key=lambda x: (x[0], x[1], x[2]))
-        new_dict = OrderedDict()
-        for k in keys:
-            new_dict[k] = one_week_orders[k]
-        return new_dict
-
-    def move(self, cell_from, cell_to, order_name, quality=None):
+        self.plans = part_orders.plans  # размеры заказов по кодам
+        self.names = part_orders.names  # имена заказов по кодам (для сообщений об ошибках)
+        self.moves = 0                  # количество перемещений (см. move)
+
+        # журнал для логирования случаев, когда переносим весь заказ
+        self.transfers_without_separation = TransferLedger()
+        # журнал для логирования случаев, когда переносим часть заказа
+        self.transfers_with_separation = TransferLedger()
+
+    def find_week(self, cell: int) -> int:
+        """ Первая неделя, начиная с cell, на которой есть заказы (len(orders), если таких нет)"""
+        next_week = self.next_week
+        while next_week[cell] != cell:
+            next_week[cell] = next_week[next_week[cell]]
+            cell = next_week[cell]
+        return cell
+
+    def move(self, cell_from, cell_to, code, quality=None):
         """ Перемещение некоторого количества двигаетелей определенного заказа из одной ячейки массива orders в другую
 
-        Другими словами - перемещение партии двигателей из заказа n_order с одной недели на другую
+        Другими словами - перемещение партии двигателей из заказа с одной недели на другую
 
         :param cell_from: номер ячейки, из которой мы будем перемещать некоторое количество двигателей
-        :param cell2: номер ячейки, в которую мы будем перемещать некоторое эти двигатели
-        :param order_name: имя заказа
+        :param cell_to: номер ячейки, в которую мы будем перемещать некоторое эти двигатели
+        :param code: код заказа
         :param quality: если мы перемещаем не весь заказ, а несколько деталей, то надо указать это количество. Если
                         перемещаем весь заказ, то параметр не указываем
         """
-        if not quality or isinstance(quality, int) and quality == self.orders[cell_from][order_name]:
-            quality = self.orders[cell_from].pop(order_name)
+        self.moves += 1
+        from_orders = self.orders[cell_from]
+        if not quality or isinstance(quality, int) and quality == from_orders[code]:
+            quality = from_orders.pop(code)
+            keys = self.order_keys[cell_from]
+            del keys[bisect.bisect_left(keys, code)]
+            if not keys:
+                self.next_week[cell_from] = cell_from + 1
         else:
-            self.orders[cell_from][order_name] -= quality
-        if order_name in self.orders[cell_to]:
-            self.orders[cell_to][order_name] += quality
+            from_orders[code] -= quality
+        self.totals[cell_from] -= quality
+
+        to_orders = self.orders[cell_to]
+        if to_orders is None:
+            to_orders = self.orders[cell_to] = {}
+            self.order_keys[cell_to] = []
+        if code in to_orders:
+            to_orders[code] += quality
         else:
-            self.orders[cell_to][order_name] = quality
-
-        self.orders[cell_to] = Record.sort_orders(self.orders[cell_to])
+            to_orders[code] = quality
+            bisect.insort(self.order_keys[cell_to], code)
+            self.next_week[cell_to] = cell_to
+        self.totals[cell_to] += quality
 
     def move_left(self, cell_from: int, cell_to: int, delta:int):
         """ Перемещение заказов на более ранние недели с отметкой этого в журнале
@@ -74,457 +209,761 @@ class Record:
         """
         if cell_from <= cell_to:
             raise Exception(f"Ошибка в порядке перемещения move_left: {cell_from} <= {cell_to}")
-        if sum(self.orders[cell_from].values()) < delta:
-            raise Exception(f"Ошибка в порядке перемещения move_left: delta ({delta}) > {sum(self.orders[cell_from].values())}")
-        from_local_order = self.orders[cell_from].copy()
-        order_names = from_local_order.keys()
-        for order_name in order_names:
-            if delta >= from_local_order[order_name]:
-                delta -= from_local_order[order_name]
-                self.move(cell_from, cell_to, order_name)
-                # print(cell_from, cell_to, order_name)
-                t = self.transfers_with_separation[self.transfers_with_separation['Заказ'] == order_name]
-                if not t.empty:
+        if self.totals[cell_from] < delta:
+            raise Exception(f"Ошибка в порядке перемещения move_left: delta ({delta}) > {self.totals[cell_from]}")
+        # заказы берутся с начала недели: перенесенный целиком заказ удаляется, и следующий оказывается первым
+        keys = self.order_keys[cell_from]
+        while keys:
+            code = keys[0]
+            quality = self.orders[cell_from][code]
+            if delta >= quality:
+                delta -= quality
+                self.move(cell_from, cell_to, code)
+                if self.transfers_with_separation.contains_order(code):
                     # в случаях, когда заказ хоть раз уже был перенесене на другие даты дробно, то необходимо указать количество для переноса,
                     # чтобы данный перенос был также записан в дробную таблицу
-                    self.mark_transition(order_name, cell_from, cell_to, from_local_order[order_name])
+                    self.mark_transition(code, cell_from, cell_to, quality)
                 else:
-                    self.mark_transition(order_name, cell_from, cell_to)
+                    self.mark_transition(code, cell_from, cell_to)
                 if delta == 0:
                     break
             else:
-                self.move(cell_from, cell_to, order_name, delta)
-                # print(cell_from, cell_to, order_name, delta)
-                self.mark_transition(order_name, cell_from, cell_to, delta)
+                self.move(cell_from, cell_to, code, delta)
+                self.mark_transition(code, cell_from, cell_to, delta)
                 break
 
-    def move_right(self, cell_from: int, cell_to: int, delta: int, quality=None):
+    def move_right(self, cell_from: int, cell_to: int, delta: int):
         """ Перемещение заказа на последующие недели (после срока)  с отметкой этого в журнале
 
         :param cell_from: из какой ячейки переносим
         :param cell_to: в какую ячейку переносим
         :param delta: количество двигателей(это может быть не один заказ, а много), которое хотим переместить
-        :param quality: сколько двигателей надо залогировать (по умолчанию - все перенесенные)
         """
         if cell_from >= cell_to:
             raise Exception(f"Ошибка в порядке перемещения move_right: {cell_from} >= {cell_to}")
-        from_local_order = Record.sort_orders(self.orders[cell_from])
-        order_names = from_local_order.keys()
-        # порядок перемещения - начинаем с более старых заказов
-        order_names = list(order_names)[::-1]
-        for order_name in order_names:
-            if order_name not in self.move_to_future:
-                self.move_to_future[order_name] = [cell_from, None]
+        # порядок перемещения - начинаем с более старых заказов, т.е. с конца недели
+        keys = self.order_keys[cell_from]
+        while keys:
+            code = keys[-1]
 
             # перемещение
-            if delta >= from_local_order[order_name]:
-                delta -= from_local_order[order_name]
-                self.move(cell_from, cell_to, order_name)
-                self.mark_transition(order_name, cell_from, cell_to)
+            quality = self.orders[cell_from][code]
+            if delta >= quality:
+                delta -= quality
+                self.move(cell_from, cell_to, code)
+                self.mark_transition(code, cell_from, cell_to)
                 if delta == 0:
                     break
 
             else:
-                self.move_to_future[order_name][1] = True
-                self.move(cell_from, cell_to, order_name, delta)
-                self.mark_transition(order_name, cell_from, cell_to, delta)
+                self.move(cell_from, cell_to, code, delta)
+                self.mark_transition(code, cell_from, cell_to, delta)
                 break
 
     def normalize(self):
         """ Обработка одной строки
+
+        Один проход по неделям: суммы недель хранятся в totals, а пустые недели пропускаются через find_week.
         """
         n = len(self.orders)
+        differences = self.differences
         for i in range(n):
-            if self.differences[i] > 0:
+            if differences[i] > 0:
                 # Если по графику мы опережаем (Gr>0, PL=0)
-                j = i + 1
-                while self.differences[i] != 0:
-                    if self.orders[j]:
-                        week_sum = sum(self.orders[j].values())
-                        if week_sum >= self.differences[i]:
-                            self.move_left(j, i, self.differences[i])
-                            self.differences[j] += self.differences[i]
-                            self.differences[i] = 0
-                        else:
-                            self.move_left(j, i, week_sum)
-                            self.differences[j] += week_sum
-                            self.differences[i] -= week_sum
-                            j += 1
+                j = self.find_week(i + 1)
+                while differences[i] != 0:
+                    if j >= n:
+                        raise Exception(f"Для детали {self.engine_id} не хватает заказов после недели "
+                                        f"{self.index_date.get(i)}, чтобы выполнить график.")
+                    week_sum = self.totals[j]
+                    if week_sum >= differences[i]:
+                        self.move_left(j, i, differences[i])
+                        differences[j] += differences[i]
+                        differences[i] = 0
                     else:
-                        j += 1
-            elif self.differences[i] < 0:
+                        self.move_left(j, i, week_sum)
+                        differences[j] += week_sum
+                        differences[i] -= week_sum
+                        j = self.find_week(j + 1)
+            elif differences[i] < 0:
                 # случай, когда отстаем от плана и надо искать производства справа
                 #
                 # в таком случае мы просто перемещаем необходимое количество заказов в правостоящую ячейку
                 j = i + 1
-                sum_ = sum(self.orders[j].values()) if self.orders[j] else 0
-                quality = min(-self.differences[i], sum_) if sum_ else sum_
-                if self.differences[j] > quality:
-                    quality = self.differences[j]
-                self.move_right(i, j, -self.differences[i], quality)
-                self.differences[j] += self.differences[i]
-                self.differences[i] = 0
-
-    def mark_transition(self, order_name: str, cell_from: int, cell_to: int, quality: int=None):
-        """ Записываем в таблички что и куда перенесли"""
-        data = {
-            'Id_125': self.engine_id,
-            'План': self.order_dict[order_name][0],
-            'вн/внутр': self.order_dict[order_name][1],
-            'Заказ': order_name,
-            'Дата кон.': self.index_date[cell_from],
-            'd+': self.index_date[cell_to],
-        }
+                if j >= n:
+                    raise Exception(f"Для детали {self.engine_id} отставание от плана на последней неделе "
+                                    f"{self.index_date.get(i)}: перенести заказы некуда.")
+                self.move_right(i, j, -differences[i])
+                differences[j] += differences[i]
+                differences[i] = 0
+
+    def mark_transition(self, code: int, cell_from: int, cell_to: int, quality: int=None):
+        """ Записываем в журналы что и куда перенесли"""
+        without_separation = self.transfers_without_separation
+        with_separation = self.transfers_with_separation
+        # в таблице без делений 'План' всегда равен размеру заказа, поэтому ищем только по (заказ, d+)
+        t = without_separation.find(code, cell_from)
         if not quality:
             # переносим весь заказ
             # если он уже был
-            t = self.transfers_without_separation[
-                (self.transfers_without_separation['Id_125'] == self.engine_id) &
-                (self.transfers_without_separation['План'] == self.order_dict[order_name][0]) &
-                (self.transfers_without_separation['Заказ'] == order_name) &
-                (self.transfers_without_separation['d+'] == self.index_date[cell_from])
-            ]
-            if not t.empty:
-                self.transfers_without_separation.loc[t.index, 'd+'] = self.index_date[cell_to]
+            if t:
+                without_separation.update(t, DATE_TO, cell_to)
             else:
                 # если еще не было, то оставляем исходные данные
-                self.transfers_without_separation = self.transfers_without_separation.append(
-                    data.copy(),
-                    ignore_index=True
-                )
+                without_separation.insert([code, self.plans[code], cell_from, cell_to, None])
         # переносим часть
         else:
-            del data['вн/внутр']
-            data['План'] = quality
-            data['Всего в заказе'] = self.order_dict[order_name][0]
             # сначала проверяем в целых
             # если найдем, то удаляем оттуда,
             # запомнив начальную дату и создав две записи
-            t = self.transfers_without_separation[
-                (self.transfers_without_separation['Id_125'] == self.engine_id) &
-                (self.transfers_without_separation['План'] == self.order_dict[order_name][0]) &
-                (self.transfers_without_separation['Заказ'] == order_name) &
-                (self.transfers_without_separation['d+'] == self.index_date[cell_from])
-            ]
-            if not t.empty:
+            if t:
                 # преобразуем запись из таблицы без делений
-                local_data = t.to_dict(orient='records')[0]
-                local_data['План'] = local_data['План'] - data['План']
-                del local_data['вн/внутр']
-                data['План'] = quality
-                local_data['Всего в заказе'] = self.order_dict[order_name][0]
+                local_data = without_separation.rows[t[0]]
                 # удаляем запись
-                self.transfers_without_separation = self.transfers_without_separation.loc[
-                    ~(self.transfers_without_separation['Id_125'] == self.engine_id) |
-                    ~(self.transfers_without_separation['План'] == self.order_dict[order_name][0]) |
-                    ~(self.transfers_without_separation['Заказ'] == order_name) |
-                    ~(self.transfers_without_separation['d+'] == self.index_date[cell_from])
-                ]
+                without_separation.delete(t)
                 # записываем в таблицу делений
-                self.transfers_with_separation = self.transfers_with_separation.append(
-                    local_data.copy(),
-                    ignore_index=True
-                )
-
-                data['Дата кон.'] = local_data['Дата кон.']
-                self.transfers_with_separation = self.transfers_with_separation.append(
-                    data.copy(),
-                    ignore_index=True
-                )
+                with_separation.insert([code, local_data[PLAN] - quality, local_data[DATE_FROM],
+                                        local_data[DATE_TO], self.plans[code]])
+                with_separation.insert([code, quality, local_data[DATE_FROM], cell_to, self.plans[code]])
             else:
                 # если в целочисленной части нету, то ищем в дробной
-                t = self.transfers_with_separation[
-                    (self.transfers_with_separation['Id_125'] == self.engine_id) &
-                    (self.transfers_with_separation['Заказ'] == order_name) &
-                    (self.transfers_with_separation['d+'] == self.index_date[cell_from])
-                    ]
-                if t.empty:
+                t = with_separation.find(code, cell_from)
+                if len(t) > 1:
+                    raise Exception(f"Заказ {self.names[code]} детали {self.engine_id} несколько раз перенесен на "
+                                    f"{self.index_date[cell_from]}.")
+                if not t:
                     # если такой записи не было, то пишем с нуля
-                    self.transfers_with_separation = self.transfers_with_separation.append(
-                        data.copy(),
-                        ignore_index=True
-                    )
-                elif int(t['План']) == quality:
+                    with_separation.insert([code, quality, cell_from, cell_to, self.plans[code]])
+                elif int(with_separation.rows[t[0]][PLAN]) == quality:
                     # в случае полного совпадения  - переносим дату
-                    self.transfers_with_separation.loc[t.index, 'd+'] = self.index_date[cell_to]
+                    with_separation.update(t, DATE_TO, cell_to)
                 else:
-                    local_delta = self.transfers_with_separation['План'] - quality
-                    data['Дата кон.'] = t.to_dict(orient='records')[0]['Дата кон.']
-                    self.transfers_with_separation.loc[t.index, 'План'] = local_delta
-                    self.transfers_with_separation = self.transfers_with_separation.append(
-                        data.copy(),
-                        ignore_index=True
-                    )
+                    local_data = with_separation.rows[t[0]]
+                    with_separation.update(t, PLAN, local_data[PLAN] - quality)
+                    with_separation.insert([code, quality, local_data[DATE_FROM], cell_to, self.plans[code]])
+
+    def transfer_rows(self, names, features) -> (list, list):
+        """ Строки результирующих таблиц: коды заменяются именами заказов, недели - датами
+
+        :param names: имена заказов по кодам
+        :param features: "вн/внутр" заказов по кодам
+        :return: записи таблицы без разделения (в порядке TRANSFER_COLUMNS) и с разделением (SEPARATION_COLUMNS)
+        """
+        engine_id = self.engine_id
+        dates = self.index_date
+        transfers = [(engine_id, plan, features[code], names[code], dates[date_from], dates[date_to])
+                     for code, plan, date_from, date_to, _ in filter(None, self.transfers_without_separation.rows)]
+        separations = [(engine_id, names[code], total, dates[date_from], plan, dates[date_to])
+                       for code, plan, date_from, date_to, total in filter(None, self.transfers_with_separation.rows)]
+        return transfers, separations
+
+
+class TimedRecord(Record):
+    """ Record с замером суммарного времени записи в журналы (только при включенных замерах)"""
+    __slots__ = ('transition_seconds', )
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.transition_seconds = 0.0
+
+    def mark_transition(self, *args):
+        start = time.perf_counter()
+        super().mark_transition(*args)
+        self.transition_seconds += time.perf_counter() - start
 
 
-def get_index_week(row, date_df):
-    """ Возвращает словари соответсвия дат и индексов будущих таблиц
+def read_config(conf_file='config.ini'):
+    """ Чтение конфиг файла
+
+    :param conf_file: имя конфиг файла
+    :return: секция DEFAULT
+    """
+    config = configparser.ConfigParser()
+    config.read_file(codecs.open(conf_file, "r", "utf8"))
+    return config['DEFAULT']
+
+
+class Calendar:
+    """ Календарь недель планирования: соответствие номеров недель, индексов будущих таблиц и дат
 
     Рассматривая каждое издение, будут созданы массивы каждый элемент которых соответствует отстованию от плана
-    на неделю или содержит список заказов на определенной неделе. Для того, чтобы не потерять соответствие дат и
-    индексов массивов ввожу дополнительные словари соответствия.
+    на неделю или содержит список заказов на определенной неделе. Календарь строится один раз и хранит соответствия
+    в обе стороны:
+        index_week - номер недели -> индекс, например {9: 0, 10: 1, ...};
+        index_date - дата недели -> индекс, например {date(2019, 3, 1): 0, date(2019, 3, 7): 1, ...};
+        weeks, dates - индекс -> номер недели и дата недели (списки).
+
+    Недели - столбцы Gr* таблицы планирования, дата недели - первая дата этой недели в таблице дат (столбцы т - номер
+    недели и тт - дата). Индексы идут по датам недель, поэтому недели, переходящие через границу года (..., 51, 52,
+    1, 2, ...), стоят в правильном порядке. Если номер недели встречается в таблице дат в разных годах, то берется
+    самый короткий по датам отрезок таблицы, на котором есть все недели планирования.
+    """
+    __slots__ = ('weeks', 'dates', 'index_week', 'index_date', 'week_dates')
 
-    index_date - словарь , где каждому индексу соответствует дата
-        например,
-        {
-            '01.03.2019': 0,
-            '07.03.2019': 1,
-            ...
-        }
-    index_week - аналогично, но только с номерами недели
-        например,
+    def __init__(self, columns, date_df):
+        """
+        :param columns: столбцы таблицы планирования
+        :param date_df: таблица дат (не изменяется)
+        """
+        keys = {int(key[2:]) for key in columns if key.startswith('Gr')}
+        candidates = self.date_weeks(date_df)
+        candidates = [(date, week) for date, week in candidates if week in keys]
+        missing = sorted(keys - {week for _, week in candidates})
+        if missing:
+            raise Exception(f"В таблице дат нет недель {', '.join(map(str, missing))}.")
+        if len(candidates) > len(keys):
+            candidates = self.shortest_window(candidates, len(keys))
+
+        self.dates = [date for date, _ in candidates]
+        self.weeks = [int(week) for _, week in candidates]
+        self.index_week = {week: i for i, week in enumerate(self.weeks)}
+        self.index_date = {date: i for i, date in enumerate(self.dates)}
+        self.week_dates = dict(enumerate(self.dates))   # индекс -> дата (см. Record)
+
+    @staticmethod
+    def date_weeks(date_df) -> list:
+        """ Недели таблицы дат: пары (первая дата недели, номер недели), отсортированные по датам
+
+        Строки с одним номером недели относятся к одной неделе, если их даты отстоят не больше, чем на неделю.
+        """
+        dates = pd.to_datetime(to_dates(date_df['тт'], "\'тт\' таблицы дат"))
+        df = pd.DataFrame({'week': date_df['т'].to_numpy(), 'date': dates.to_numpy(), 'row': np.arange(len(dates))})
+        df = df.dropna(subset=['week']).sort_values(['week', 'date'], kind='stable')
+        new_week = (df['week'] != df['week'].shift()) | (df['date'].diff() > pd.Timedelta(days=7))
+        first = df.groupby(new_week.cumsum().to_numpy(), sort=False)['row'].idxmin()
+        weeks = df.loc[first].sort_values(['date', 'row'])
+        return list(zip(weeks['date'].dt.date, weeks['week'].tolist()))
+
+    @staticmethod
+    def shortest_window(candidates: list, n_keys: int) -> list:
+        """ Самый короткий по датам отрезок недель (отсортированных по датам), на котором есть все n_keys номеров"""
+        counts = {}
+        best = None
+        left = 0
+        for right, (date, week) in enumerate(candidates):
+            counts[week] = counts.get(week, 0) + 1
+            while counts[candidates[left][1]] > 1:
+                counts[candidates[left][1]] -= 1
+                left += 1
+            if len(counts) == n_keys and (best is None or date - candidates[left][0] < best[0]):
+                best = (date - candidates[left][0], left, right)
+        _, left, right = best
+        window = {}
+        for date, week in candidates[left:right + 1]:
+            window.setdefault(week, date)
+        return sorted((date, week) for week, date in window.items())
+
+    def check_orders(self, order_df, engine_ids, date_sheet):
+        """ Проверка, что даты всех заказов анализируемых деталей есть в календаре
+
+        Проверяются сразу все заказы, ошибка выдается со всеми неверными заказами.
+
+        :param order_df: таблица заказов (со столбцом datetime, см. read_tables)
+        :param engine_ids: ID_125 строк планирования
+        :param date_sheet: вкладка с датами (для сообщения об ошибке)
+        """
+        bad = order_df['Id_125'].isin(engine_ids) & order_df['datetime'].map(self.index_date).isna()
+        if not bad.any():
+            return
+        bad_df = order_df[bad]
+        titles = bad_df['Наименование'] if 'Наименование' in bad_df else pd.Series('', index=bad_df.index)
+        orders = [f"{order} - {date.strftime('%d.%m.%Y')} (наименование \'{str(title).strip()}\')"
+                  for order, date, title in zip(bad_df['Заказ'], bad_df['datetime'], titles)]
+        raise Exception(f"Дата кон. заказов отсутствует в таблице дат (даты находятся на вкладке {date_sheet}): "
+                        f"{', '.join(orders)}.")
+
+
+def get_order_keys(names: pd.Series) -> pd.DataFrame:
+    """ Ключи сортировки заказов на одну неделю - два номера из имени заказа
+
+    Имена имеют вид ``...<первое число>*-...-...-<второе число>...``: первое число - цифры, которыми заканчивается
+    часть имени до первой '*', второе - последняя часть имени после '-' до '/' (только если в имени есть '*').
+    Если числа нет, вместо него берется 0. Каждое уникальное имя разбирается один раз.
+
+    :param names: столбец 'Заказ'
+    :return: таблица с целочисленными столбцами num1, num2 и тем же индексом, что у names
+    """
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+
+    # первое число
+    num1 = uniques.str.split('*', n=1).str[0].str.extract(r'(\d+)\Z', expand=False)
+
+    # второе число
+    str2 = uniques.str.rsplit('-', n=1).str[-1].str.split('/', n=1).str[0]
+    has_num2 = (uniques.str.contains('*', regex=False) & uniques.str.contains('-', regex=False) &
+                str2.str.fullmatch(r'\s*\+?\d+(?:_\d+)*\s*'))
+    num2 = str2.where(has_num2).str.replace(r'[\s+_]', '', regex=True)
+
+    keys = pd.DataFrame({'num1': num1.fillna('0').astype(np.int64), 'num2': num2.fillna('0').astype(np.int64)})
+    return keys.take(codes).set_index(names.index)
+
+
+def get_order_index(order_df, index_date):
+    """ Индекс заказов по деталям
+
+    Строится один раз для всей таблицы заказов, чтобы при анализе строки планирования не просматривать таблицу
+    заказов целиком. Для каждой детали заказы отсортированы по ключу (num1, num2, k), где num1, num2 - ключи
+    сортировки (см. get_order_keys), а k убывает от 10000 в порядке следования заказов детали в таблице. Номер заказа
+    в этом порядке (код) заменяет ключ при анализе (см. Record):
         {
-            9: 0,
-            10: 1,
+            Id_125: PartOrders(weeks=<индексы недель>, plans=<План>, names=<имена>, features=<вн/внутр>,
+                               missing=None),
             ...
         }
+    Недели и количества хранятся в array (если План целочисленный), имена - ссылки на строки таблицы заказов.
+    Если у детали есть заказы, чьей даты нет в index_date, то в missing записывается первый из них в виде
+    (имя, дата, наименование): ошибка по нему выдается только при анализе соответствующей детали.
+
+    :param order_df: таблица заказов
+    :param index_date: соответсвие дат индексам
+    :return: словарь описанного выше вида
     """
-    keys = row.keys()
-    keys = [int(key[2:]) for key in keys if key.startswith('Gr')]
-    keys.sort()
-    index_week = {keys[i]: i for i in range(len(keys))}
+    engine_codes, engine_ids = pd.factorize(order_df['Id_125'], use_na_sentinel=False)
+    weeks = order_df['datetime'].map(index_date)
+    k = 10000 - pd.Series(engine_codes).groupby(engine_codes).cumcount().to_numpy()
+    missing = weeks.isna().to_numpy()
+    order = np.lexsort((k, order_df['num2'].to_numpy(), order_df['num1'].to_numpy(), missing, engine_codes))
+    bounds = np.searchsorted(engine_codes[order], np.arange(len(engine_ids) + 1))
+
+    integer_plans = pd.api.types.is_integer_dtype(order_df['План'])
+    weeks = weeks.to_numpy()[order]
+    plans = order_df['План'].to_numpy()[order].tolist()
+    names = order_df['Заказ'].to_numpy(dtype=object)[order].tolist()
+    features = order_df['вн/внутр'].to_numpy()[order].tolist()
+    missing = missing[order]
+    if 'Наименование' in order_df:
+        titles = order_df['Наименование'].to_numpy(dtype=object)
+    else:
+        titles = [''] * len(order_df)
+    dates = order_df['datetime'].to_numpy(dtype=object)
+
+    order_index = {}
+    for engine_id, start, stop in zip(engine_ids.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+        # заказы без даты в таблице дат идут в конце детали
+        end = start + int(np.count_nonzero(~missing[start:stop]))
+        first_missing = None
+        if end < stop:
+            row = order[start:stop][missing[start:stop]].min()
+            first_missing = (order_df['Заказ'].iat[row], dates[row], titles[row])
+        order_index[engine_id] = PartOrders(
+            array.array('l', weeks[start:end].astype(np.int64).tolist()),
+            array.array('q', plans[start:end]) if integer_plans else tuple(plans[start:end]),
+            tuple(names[start:end]), tuple(features[start:end]), first_missing)
+    return order_index
+
+
+def get_record(engine_id, differences: list, order_index: dict, calendar, conf_file='config.ini', stats=None):
+    """ Производит анализ одной строки планирования (см. get_record_rows)
 
-    date_df['datetime'] = date_df['тт'].apply(lambda x: datetime.date(x.year, x.month, x.day))
-    index_date = {date_df.loc[date_df['т'] == keys[i]].get('datetime').values[0]: i for i in range(len(keys))}
-    return index_week, index_date
+    :return: pandas.DataFrame - таблица перенесенных заказов без разделения
+             pandas.DataFrame - таблица перенесенных заказов, когда произошло разделение
+    """
+    transfers, separations = get_record_rows(engine_id, differences, order_index, calendar, conf_file, stats)
+    return pd.DataFrame(transfers, columns=TRANSFER_COLUMNS), pd.DataFrame(separations, columns=SEPARATION_COLUMNS)
 
 
-def get_order_keys(key):
-    """ сортируем заказы на одну неделю в порядке возрастания двух номеров
-    """
-    num1 = 0
-    x = key.split('*')
-    str1 = x[0]
-    n = len(str1)
-    for i in range(n):
-        try:
-            local_num = int(str1[n - i - 1])
-            num1 += local_num * 10 ** i
-        except:
-            break
-
-    # получаем второе число
-    num2 = 0
-    if len(x) > 1:
-        x = key.split('-')
-        if len(x) > 1:
-            str2 = x[-1]
-            try:
-                local_num = int(str2.split('/')[0])
-                num2 += local_num
-            except:
-                pass
-    return num1, num2
-
-
-
-def get_record(row, order_df, index_week, index_date, conf_file='config.ini'):
+def get_record_rows(engine_id, differences: list, order_index: dict, calendar, conf_file='config.ini',
+                    stats=None):
     """ Производит анализ одной строки планирования
 
     Переносы фиксируются в необходимые файлы
 
-    :param row: pandas.Series - одна строка таблицы планирования
-    :param order_df: pandas.DataFrame - таблица заказов
-    :param index_week: соответсвие индексов номерам недель
-    :param index_date: соответсвие индексов пятницам(дням)
+    :param engine_id: ID_125 детали
+    :param differences: строка матрицы несостыковок графика и плана (см. get_differences)
+    :param order_index: индекс заказов по деталям (см. get_order_index)
+    :param calendar: календарь недель (см. Calendar)
     :param conf_file: имя конфиг файла. необходим для более информативного вывода ошибок.
-    :return: pandas.DataFrame - таблица перенесенных заказов без разделения
-             pandas.DataFrame - таблица перенесенных заказов, когда произошло разделение
+    :param stats: словарь для замеров (см. модуль metrics): если передан, то в него записываются время анализа,
+                  время нормализации и записи в журналы, количество перемещений
+    :return: записи таблицы перенесенных заказов без разделения (кортежи в порядке TRANSFER_COLUMNS)
+             записи таблицы перенесенных заказов, когда произошло разделение (в порядке SEPARATION_COLUMNS)
     """
-    # сначала сформируем массив несостыковки планов и графиков
-    differences = [0 for _ in range(len(index_week))]
-    for k in row.keys():
-        if k.startswith("Gr") and row[k]:
-            differences[index_week[int(k[2:])]] += int(row[k])
-        if k.startswith("Pl") and row[k]:
-            differences[index_week[int(k[2:])]] -= int(row[k])
-    #print(differences)
-
-    # формируем массив заказов
-    orders = [{} for _ in range(len(index_week))]
-    engine_id = row['ID_125']
-    local_order_df = order_df.loc[order_df['Id_125'] == engine_id]
-    local_order_dict = {}
-    order_types = {}
-    order_ids = {}
-    k = 10000
-    for ind, local_row in local_order_df.iterrows():
-        order = local_row['Заказ']
-        num1, num2 = get_order_keys(order)
-        key = (num1, num2, k)
-        k -= 1
-        date = local_row['datetime']
-        number_of_engines = local_row['План']
-        if date not in index_date:
-            config = configparser.ConfigParser()
-            config.read_file(codecs.open(conf_file, "r", "utf8"))
-            ord_name = local_row['Наименование'].strip()
-            raise Exception(f"Дата кон. \'{date.strftime('%d.%m.%Y')}\' заказа {order} (наименование \'{ord_name}\') "
-                            f"отсутствует в таблице дат (даты находятся на вкладке {config['DEFAULT']['date_sheet']}).")
-        orders[index_date[date]][key] = number_of_engines
-
-        # замена имен заказов на id вида <номер элемента массива>ххх
-        # другими словами, генерация словаря вида {id1: name1, id2: name2, ...} (имена могут повторяться)
-        order_ids[key] = order
-        local_order_dict[key] = [number_of_engines, local_row['вн/внутр']]
-
-
-    invert_index_date = {v: k for k, v in index_date.items()}
-
-    record = Record(engine_id, differences, orders, invert_index_date, local_order_dict)
+    start = time.perf_counter() if stats is not None else None
+    part_orders = order_index.get(engine_id, EMPTY_ORDERS)
+    if part_orders.missing is not None:
+        order, date, title = part_orders.missing
+        def_section = read_config(conf_file)
+        ord_name = str(title).strip()
+        raise Exception(f"Дата кон. \'{date.strftime('%d.%m.%Y')}\' заказа {order} (наименование \'{ord_name}\') "
+                        f"отсутствует в таблице дат (даты находятся на вкладке {def_section['date_sheet']}).")
+
+    record_class = TimedRecord if stats is not None else Record
+    record = record_class(engine_id, differences, part_orders, calendar.week_dates)
+    normalize_start = time.perf_counter() if stats is not None else None
     record.normalize()
+    if stats is not None:
+        stats['normalize_seconds'] = time.perf_counter() - normalize_start
+        stats['mark_transition_seconds'] = record.transition_seconds
+        stats['moves'] = record.moves
 
-    # замена id на имена заказов в результирующей таблице
-    def key_to_name(row):
-        key = row['Заказ']
-        if key in order_ids:
-            row['Заказ'] = order_ids[key]
-        return row
-
-    transfers_without_separation = record.transfers_without_separation
-    transfers_without_separation = transfers_without_separation.apply(key_to_name, axis=1)
-    transfers_with_separation = record.transfers_with_separation
-    transfers_with_separation = transfers_with_separation.apply(key_to_name, axis=1)
+    # замена кодов на имена заказов в результирующей таблице
+    transfers_without_separation, transfers_with_separation = record.transfer_rows(part_orders.names,
+                                                                                   part_orders.features)
 
+    if stats is not None:
+        stats['seconds'] = time.perf_counter() - start
     return transfers_without_separation, transfers_with_separation
 
 
-def check_schedule_table(schedule_df):
+def get_differences(schedule_df, index_week):
+    """ Матрица несостыковок графика и плана
+
+    Каждая строка соответствует строке таблицы планирования, каждый столбец - неделе (в порядке index_week).
+    Значения столбцов Gr* прибавляются, значения столбцов Pl* вычитаются. Столбцы ищутся один раз для всей
+    таблицы, а не для каждой строки.
+
+    :param schedule_df: таблица планирования (пустоты заполнены нулями)
+    :param index_week: соответсвие номеров недель индексам
+    :return: numpy.ndarray размера <число деталей> x <число недель>
+    """
+    differences = np.zeros((len(schedule_df), len(index_week)), dtype=np.int64)
+    for prefix, sign in (('Gr', 1), ('Pl', -1)):
+        columns = [k for k in schedule_df.columns if k.startswith(prefix)]
+        if not columns:
+            continue
+        weeks = [int(k[2:]) for k in columns]
+        unknown = [k for k, week in zip(columns, weeks) if week not in index_week]
+        if unknown:
+            raise Exception(f"Таблица планирования неверна: для столбцов {unknown} нет соответствующих столбцов Gr*.")
+        values = np.trunc(schedule_df[columns].to_numpy(dtype=np.float64)).astype(np.int64)
+        np.add.at(differences.T, [index_week[week] for week in weeks], sign * values.T)
+    return differences
+
+
+def check_schedule_table(schedule_df, differences):
     """ Проверка, что в таблице планирования нету ошибки
 
     если сумма чисел под Gr* не равна сумме чисел под PL*, то выдастся соответствующая ошибка
+    (сразу со всеми неверными строками)
+
+    :param schedule_df: таблица планирования
+    :param differences: матрица несостыковок (см. get_differences)
     """
-    error_indexes = []
-    for index, row in schedule_df.iterrows():
-        sum_ = 0
-        for k in row.keys():
-            if k.startswith("Gr") and row[k]:
-                sum_ += row[k]
-            if k.startswith("Pl") and row[k]:
-                sum_ -= row[k]
-        if sum_ != 0:
-            error_indexes.append(index)
+    error_indexes = schedule_df.index[differences.sum(axis=1) != 0].tolist()
     if error_indexes:
         raise Exception(f"Таблица планирования неверна: в строках {error_indexes} нестыковки по графику и плану "
                         f"разнятся.")
 
 
-def features_to_numbers(row):
-    """ Преобразует значение поля 'вн/внутр' в соответствующее число
+def features_to_numbers(order_df) -> pd.Series:
+    """ Преобразует значения столбца 'вн/внутр' в соответствующие числа
 
-    param: row - строка таблицы dataframe
-    return: преобразованная строка
+    Строка 'внешний' (без учета пробелов по краям) - 1, любая другая строка - 2, числа 1 и 2 остаются как есть.
+    Если встречаются другие значения, то ошибка выдается сразу по всем таким заказам.
+
+    param: order_df - таблица заказов
+    return: столбец чисел
     """
-    if not isinstance(row['вн/внутр'], str):
-        if isinstance(row['вн/внутр'], int) and row['вн/внутр'] in [1, 2]:
-            return row
-        else:
-            t = type(row['вн/внутр'])
-            raise Exception(f"Ошибка при обработке столбца \'вн/внутр\' заказа {row['Заказа']}. "
-                            f"Значение {row['вн/внутр']}, тип {t}.")
-    s = row['вн/внутр'].strip()
-    row['вн/внутр'] = 1 if 'внешний' == s else 2
-    return row
+    values = order_df['вн/внутр'].to_numpy(dtype=object)
+    is_string = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+    is_number = np.fromiter((isinstance(value, (int, np.integer)) and value in (1, 2) for value in values),
+                            dtype=bool, count=len(values))
+    bad = ~(is_string | is_number)
+    if bad.any():
+        errors = '; '.join(f"заказ {order}: значение {value}, тип {type(value)}"
+                           for order, value in zip(order_df['Заказ'].to_numpy(dtype=object)[bad], values[bad]))
+        raise Exception(f"Ошибка при обработке столбца \'вн/внутр\' ({int(bad.sum())} шт.): {errors}.")
+    numbers = np.full(len(values), 2, dtype=np.int64)
+    numbers[is_number] = values[is_number].astype(np.int64)
+    external = pd.Series(values[is_string], dtype=object).str.strip().eq('внешний').to_numpy(dtype=bool)
+    numbers[np.flatnonzero(is_string)[external]] = 1
+    return pd.Series(numbers, index=order_df.index)
+
+
+def to_dates(values: pd.Series, what: str) -> pd.Series:
+    """ Даты (datetime.date) из столбца с датой и временем
+
+    Даты и время из книги берутся как есть, а строки разбираются только в виде дд.мм.гггг или ISO (гггг-мм-дд):
+    строка '04.01.2019' - это 4 января, а не 1 апреля.
+
+    :param values: столбец
+    :param what: что это за столбец - для сообщения об ошибке
+    :return: столбец datetime.date. Если в столбце есть не даты, то ошибка выдается сразу по всем таким строкам
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        dates = values
+    else:
+        items = values.tolist()
+        is_date = np.array([isinstance(value, (datetime.date, np.datetime64)) for value in items], dtype=bool)
+        is_string = np.array([isinstance(value, str) for value in items], dtype=bool)
+        dates = pd.to_datetime(values.where(is_date), errors='coerce')
+        if is_string.any():
+            strings = values[is_string].str.strip()
+            parsed = pd.to_datetime(strings, format='%d.%m.%Y', errors='coerce')
+            dates[is_string] = parsed.fillna(pd.to_datetime(strings, format='ISO8601', errors='coerce'))
+    bad = dates.isna()
+    if bad.any():
+        errors = ', '.join(f"строка {index}: {value}" for index, value in values[bad].items())
+        raise Exception(f"В столбце {what} не даты ({int(bad.sum())} шт.): {errors}.")
+    return dates.dt.date.astype(object)
+
+
+def read_tables(def_section, schedule=True):
+    """ Чтение стартовых таблиц из файла и их нормализация
+
+    Обрезаем лишние пробелы справа и слева в именах столбцов, заменяем "вн/внутр" на числа, пустоты в таблице
+    планирования заполняем нулями. В таблицу заказов добавляются ключи сортировки num1, num2 (см. get_order_keys).
+
+    :param def_section: секция конфиг файла (источник таблиц - см. модуль readers)
+    :param schedule: читать ли таблицу планирования (при потоковом анализе она читается частями, см. iter_schedule)
+    :return: order_df - большая таблица заказов,
+             schedule_df - таблица плана (None, если schedule=False),
+             date_df - таблица дат
+    """
+    with metrics.stage('read_input'):
+        order_df, schedule_df, date_df = readers.get_reader(def_section).read(schedule)
+
+    if schedule_df is not None:
+        schedule_df = schedule_df.fillna(0)     # заполнили пробелы ноликами
+
+    # обрезаем лишние пробелы у столбцов, чтобы не было проблем при обращении по именам
+    for datafr in [order_df, schedule_df, date_df]:
+        if datafr is None:
+            continue
+        columns = {i: i.strip() for i in list(datafr.columns) if i != i.strip()}
+        if columns:
+            print(columns)
+            datafr = datafr.rename(columns=columns, inplace=True)
+
+    order_df['datetime'] = to_dates(order_df['Дата кон.'], "\'Дата кон.\' таблицы заказов")
+
+    # преобразуем все значения столбца вн/внутр в числа
+    with metrics.stage('features_to_numbers'):
+        order_df['вн/внутр'] = features_to_numbers(order_df)
+
+    # ключи сортировки заказов
+    with metrics.stage('get_order_keys'):
+        order_df[['num1', 'num2']] = get_order_keys(order_df['Заказ'])
+    return order_df, schedule_df, date_df
+
+
+def load_tables(def_section, schedule=True):
+    """ Нормализованные стартовые таблицы (см. read_tables) с использованием кэша на диске
+
+    Кэш включается ключом cache_dir конфиг файла. Ключ записи - содержимое файла и имена вкладок, поэтому при
+    изменении файла или конфига таблицы будут прочитаны заново.
+    """
+    cache_dir = def_section.get('cache_dir', fallback='')
+    if not cache_dir:
+        return read_tables(def_section, schedule)
+
+    key = cache.cache_key(readers.get_reader(def_section).paths(), def_section['order_sheet'],
+                          def_section['schedule_sheet'] if schedule else '', def_section['date_sheet'])
+    tables = cache.load(cache_dir, key)
+    if tables is None:
+        tables = read_tables(def_section, schedule)
+        cache.save(cache_dir, key, tables, def_section.getint('cache_size_mb', fallback=512) * 2 ** 20)
+    return tables
+
+
+def iter_schedule(def_section, chunk_size: int):
+    """ Чтение таблицы планирования частями по chunk_size строк
+
+    Из xlsx, csv и parquet строки читаются потоково (см. модуль readers), поэтому в памяти находится только текущая
+    часть, а xls читается целиком и делится на части. Части нормализуются как в read_tables (пустоты - нули, пробелы в
+    именах столбцов обрезаны), индексы строк сквозные, как у таблицы, прочитанной целиком.
+
+    :param def_section: секция конфиг файла
+    :param chunk_size: количество строк в части
+    :return: генератор pandas.DataFrame (хотя бы одна часть, пусть и пустая - по ней определяются столбцы)
+    """
+    for schedule_df in readers.get_reader(def_section).iter_schedule(chunk_size):
+        yield schedule_df.fillna(0).rename(columns=lambda column: str(column).strip())
+
+
+def iter_chunk_tables(conf_file='config.ini', chunk_size=10000):
+    """ Стартовые таблицы для потокового анализа: по одним Tables на каждую часть таблицы планирования
+
+    Таблицы заказов и дат читаются один раз (с кэшем, см. load_tables), календарь и индекс заказов строятся по
+    первой части. Каждая часть таблицы планирования проверяется отдельно (см. check_schedule_table,
+    Calendar.check_orders), в Tables попадают только она и ее несостыковки, поэтому память не зависит от количества
+    строк планирования.
+
+    :param conf_file: имя конфиг файла
+    :param chunk_size: количество строк планирования в части
+    :return: генератор Tables (см. get_tables)
+    """
+    def_section = read_config(conf_file)
+    with metrics.stage('load_tables'):
+        order_df, _, date_df = load_tables(def_section, schedule=False)
+    with metrics.stage('order_type'):
+        order_type = order_df.groupby('Заказ', sort=False)['вн/внутр'].first().to_dict()
+
+    tables = None
+    for schedule_df in iter_schedule(def_section, chunk_size):
+        if tables is None:
+            calendar = Calendar(schedule_df.columns, date_df)
+            with metrics.stage('get_order_index'):
+                order_index = get_order_index(order_df, calendar.index_date)
+                order_arrays = batch.order_arrays(order_df, calendar.index_date)
+            tables = Tables(order_df, None, date_df, order_type, None, calendar, order_index, order_arrays)
+        differences = get_differences(schedule_df, tables.calendar.index_week)
+        check_schedule_table(schedule_df, differences)
+        tables.calendar.check_orders(order_df, schedule_df['ID_125'], def_section['date_sheet'])
+        yield tables._replace(schedule_df=schedule_df, differences=differences)
+
+
+def plan_chunks(chunk_tables, workers=1, conf_file='config.ini', engine='record'):
+    """ Анализ строк планирования по частям (см. iter_chunk_tables, plan_records)
+
+    Индекс заказов и календарь у всех частей общие, поэтому при workers > 1 пул процессов создается один раз на все
+    части: индекс заказов передается в каждый процесс один раз, а не с каждой частью.
+
+    :return: генератор пар списков записей (см. get_record_rows) в порядке строк таблицы планирования
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+    chunk_tables = iter(chunk_tables)
+    first = next(chunk_tables, None)
+    if first is None:
+        return
+    if workers == 1:
+        for tables in itertools.chain([first], chunk_tables):
+            yield from plan_records(tables, workers, conf_file, engine=engine)
+        return
+    with _record_executor(first, workers, conf_file) as executor:
+        for tables in itertools.chain([first], chunk_tables):
+            yield from plan_records(tables, workers, conf_file, engine=engine, executor=executor)
 
 
 def get_tables(conf_file='config.ini'):
     """ Получение и минимальное форматирование стартовых таблиц
 
-    Обрезаем лишние пробелы справа и слева в именах столбцов
-
     :param conf_file: имя конфиг файла
-    :return: order_df - большая таблица заказов с заменой "вн/внутр" на числа,
+    :return: Tables:
+             order_df - большая таблица заказов с заменой "вн/внутр" на числа,
              schedule_df - таблица плана (пустоты заполнены нулями),
-             date_df - таблица дат буз изменений,
-             order_type - просто запоминает "вн/внутр" для каждого заказа
+             date_df - таблица дат без изменений,
+             order_type - просто запоминает "вн/внутр" для каждого заказа,
+             differences - матрица несостыковок графика и плана (см. get_differences),
+             calendar - соответствие недель и дат индексам (см. Calendar),
+             order_index - индекс заказов по деталям (см. get_order_index)
     """
-    config = configparser.ConfigParser()
-    config.read_file(codecs.open(conf_file, "r", "utf8"))
-    def_section = config['DEFAULT']
-    xl = pd.ExcelFile(def_section['filepath'])
+    def_section = read_config(conf_file)
+    with metrics.stage('load_tables'):
+        order_df, schedule_df, date_df = load_tables(def_section)
+    return make_tables(def_section, order_df, schedule_df, date_df)
 
-    # большая таблица заказов
-    order_df = xl.parse(def_section['order_sheet'], skiprows=2)
-    order_df['datetime'] = order_df['Дата кон.'].apply(lambda x: datetime.date(x.year, x.month, x.day))
 
-    # даты
-    date_df = xl.parse(def_section['date_sheet'])
+def make_tables(def_section, order_df, schedule_df, date_df, previous=None):
+    """ Стартовые таблицы из нормализованных таблиц (см. read_tables, get_tables)
 
-    # таблица планирования
-    schedule_df = xl.parse(def_section['schedule_sheet'], skiprows=1)
-    schedule_df = schedule_df.fillna(0)     # заполнили пробелы ноликами
-    check_schedule_table(schedule_df)
-    xl.close()
+    :param def_section: секция конфиг файла
+    :param previous: стартовые таблицы предыдущего чтения того же источника (например, в режиме наблюдения, см.
+                     модуль watch). Если таблицы заказов и недели не изменились, то вн/внутр заказов и индекс
+                     заказов берутся из них, а не строятся заново
+    """
+    # несостыковки графика и плана считаются один раз для всей таблицы
+    with metrics.stage('get_differences'):
+        calendar = Calendar(schedule_df.columns, date_df)
+        differences = get_differences(schedule_df, calendar.index_week)
+        check_schedule_table(schedule_df, differences)
 
-    # обрезаем лишние пробелы у столбцов, чтобы не было проблем при обращении по именам
-    for datafr in [order_df, schedule_df, date_df]:
-        columns = {i: i.strip() for i in list(datafr.columns) if i != i.strip()}
-        if columns:
-            print(columns)
-            datafr = datafr.rename(columns=columns, inplace=True)
+    # даты всех заказов проверяются сразу, а не при анализе каждой детали
+    with metrics.stage('check_orders'):
+        calendar.check_orders(order_df, schedule_df['ID_125'], def_section['date_sheet'])
 
-    # преобразуем все значения столбца вн/внутр в числа
-    order_df = order_df.apply(features_to_numbers, axis=1)
+    if previous is not None and calendar.index_date == previous.calendar.index_date and \
+            order_df.equals(previous.order_df):
+        return Tables(previous.order_df, schedule_df, date_df, previous.order_type, differences, calendar,
+                      previous.order_index, previous.order_arrays)
 
     # словарь вн/внутр для заказов
-    unique_orders_names = order_df['Заказ'].unique()
-    order_type = {}
-    for name in unique_orders_names:
-        order_type[name] = order_df[order_df['Заказ'] == name]['вн/внутр'].values[0]
+    with metrics.stage('order_type'):
+        order_type = order_df.groupby('Заказ', sort=False)['вн/внутр'].first().to_dict()
+
+    # заказы по деталям и неделям - один проход по таблице заказов; массивы заказов для пакетного анализа
+    with metrics.stage('get_order_index'):
+        order_index = get_order_index(order_df, calendar.index_date)
+        order_arrays = batch.order_arrays(order_df, calendar.index_date)
+
+    return Tables(order_df, schedule_df, date_df, order_type, differences, calendar, order_index, order_arrays)
+
+
+class IterationSplitter:
+    """ Разделение частичных переносов на итерации по мере поступления строк
 
-    return order_df, schedule_df, date_df, order_type
+    Если в результатах заказ делился несколько раз, то его первая часть попадает в итерацию 0, вторая - в итерацию 1
+    и т.д. (в "Всего в заказе" - сколько двигателей заказа еще не перенесено). Часть, которой заказ переносится
+    полностью, попадает на вкладку res_2. Строки обрабатываются за один проход, поэтому их можно передавать группами
+    (например, по деталям) сразу после анализа.
+    """
+
+    def __init__(self, order_types):
+        self.order_types = order_types
+        # (Id_125, Заказ, Всего в заказе, Дата кон.) -> (номер следующей итерации, перенесено двигателей)
+        self.orders = {}
+        self.iterations = 0     # количество итераций
+
+    def split(self, rows) -> (dict, list):
+        """ Разделение очередной группы строк
+
+        :param rows: строки таблицы частичных переносов (в порядке столбцов SEPARATION_COLUMNS)
+        :return: словарь {номер итерации: [строки в порядке SEPARATION_COLUMNS]} и список строк вкладки res_2
+                 (в порядке TRANSFER_COLUMNS)
+        """
+        iterations = {}
+        second_integer_orders = []
+        for engine_id, order_name, total, date, plan, date_to in rows:
+            key = (engine_id, order_name, total, date)
+            index, number_of_engines = self.orders.get(key, (0, 0))
+            self.iterations = max(self.iterations, 1)
+            if total - number_of_engines != plan:
+                iterations.setdefault(index, []).append(
+                    (engine_id, order_name, total - number_of_engines, date, plan, date_to))
+                self.orders[key] = (index + 1, number_of_engines + plan)
+                self.iterations = max(self.iterations, index + 1)
+            else:
+                second_integer_orders.append(
+                    (engine_id, plan, self.order_types[order_name], order_name, date, date_to))
+                self.orders[key] = (index, number_of_engines + plan)
+        return iterations, second_integer_orders
 
 
 def split_into_iterations(df_separation, order_types) -> (list, pd.DataFrame):
     """ Разделим результат (разделяющиеся заказы) на итерации в случае, если в результатах заказ делился несколько раз
+    (см. IterationSplitter)
     """
-    iterations = []
-    second_integer_order_df = pd.DataFrame(columns=['Id_125', 'План', 'вн/внутр', 'Заказ', 'Дата кон.', 'd+'])
-    select_columns = ['Id_125', 'Заказ', 'Всего в заказе', 'Дата кон.']
-    columns2 = ['Id_125', 'Заказ', 'Всего в заказе', 'Дата кон.', 'План', 'd+']
-    orders = {}
-    for row in df_separation.to_dict(orient='records'):
-        keys = str({k: v for k, v in row.items() if k in select_columns})
-        if keys in orders:
-            index = orders[keys][0]
-            number_of_engines = orders[keys][1]
-            update_row = row.copy()
-            update_row['Всего в заказе'] -= number_of_engines
-            while len(iterations) < index + 1 and update_row['Всего в заказе'] != update_row['План']:
-                iterations.append(pd.DataFrame(columns=columns2))
-            if update_row['Всего в заказе'] != update_row['План']:
-                iterations[index] = iterations[index].append(
-                    update_row.copy(),
-                    ignore_index=True
-                )
-                orders[keys] = [index + 1, number_of_engines + row['План']]
-            else:
-                del update_row['Всего в заказе']
-                update_row['вн/внутр'] = order_types[update_row['Заказ']]
-                second_integer_order_df = second_integer_order_df.append(
-                    update_row.copy(),
-                    ignore_index=True
-                )
-                orders[keys][1] = number_of_engines + row['План']
-        else:
-            if not iterations:
-                iterations.append(pd.DataFrame(columns=columns2))
-            update_row = row.copy()
-            if update_row['Всего в заказе'] != update_row['План']:
-                iterations[0] = iterations[0].append(
-                    update_row.copy(),
-                    ignore_index=True
-                )
-                orders[keys] = [1, row['План']]
-            else:
-                del update_row['Всего в заказе']
-                update_row['вн/внутр'] = order_types[update_row['Заказ']]
-                second_integer_order_df = second_integer_order_df.append(
-                    update_row.copy(),
-                    ignore_index=True
-                )
-                orders[keys] = [0, row['План']]
-    return iterations, second_integer_order_df
+    splitter = IterationSplitter(order_types)
+    iterations, second_integer_orders = splitter.split(
+        df_separation[SEPARATION_COLUMNS].itertuples(index=False, name=None))
+    iterations = [pd.DataFrame(iterations.get(i, []), columns=SEPARATION_COLUMNS) for i in range(splitter.iterations)]
+    return iterations, pd.DataFrame(second_integer_orders, columns=TRANSFER_COLUMNS)
+
+
+def separation_sheet(def_section, iteration) -> str:
+    return def_section['result_separation_sheet'] + f"(iter-{iteration})"
+
+
+def write_separation(writer, splitter, rows, def_section):
+    """ Запись очередной группы частичных переносов, разделенных на итерации (см. IterationSplitter)
+
+    :param writer: писатель результата (см. модуль writers)
+    :param splitter: IterationSplitter, общий для всех групп строк
+    :param rows: строки таблицы частичных переносов (в порядке столбцов SEPARATION_COLUMNS)
+    :param def_section: секция конфиг файла - для именования вкладок
+    """
+    iterations, second_integer_orders = splitter.split(rows)
+    if second_integer_orders:
+        writer.write_rows('res_2', TRANSFER_COLUMNS, second_integer_orders)
+    for i in sorted(iterations):
+        writer.write_rows(separation_sheet(def_section, i), SEPARATION_COLUMNS, iterations[i])
+
+
+def close_result(writer, splitter, def_section):
+    """ Завершение записи результата: вкладки идут в порядке res, res_2, res_separ(iter-0), res_separ(iter-1)...
+
+    Вкладка итерации 0 создается, даже если в нее не попало ни одной строки (как только есть частичные переносы).
+    """
+    sheet_order = [def_section['result_sheet'], 'res_2']
+    for i in range(splitter.iterations):
+        sheet_name = separation_sheet(def_section, i)
+        if sheet_name not in writer.sheets:
+            writer.write_rows(sheet_name, SEPARATION_COLUMNS, [])
+        sheet_order.append(sheet_name)
+    with metrics.stage('write_result'):
+        writer.close(sheet_order)
 
 
 def write_to_file(df_, df_separation, order_types, conf_file='config.ini'):
@@ -535,35 +974,290 @@ def write_to_file(df_, df_separation, order_types, conf_file='config.ini'):
     :param order_types: словарь вида {заказ: "вн/внешн" этого заказа в виде числа}
     :param conf_file: имя кофиг файлы - для именования выходного файла и стобцов в нем
     """
-    config = configparser.ConfigParser()
-    config.read_file(codecs.open(conf_file, "r", "utf8"))
-    def_section = config['DEFAULT']
-    df_separation_list, second_integer_order_df = split_into_iterations(df_separation, order_types)
-    with pd.ExcelWriter(def_section['result_filepath'], engine='xlsxwriter', date_format='dd.mm.yyyy') as writer:
-        df_.to_excel(writer, sheet_name=def_section['result_sheet'], index=False)
-        if not second_integer_order_df.empty:
-            second_integer_order_df.to_excel(writer, sheet_name='res_2', index=False)
-        for i, df_sep in enumerate(df_separation_list):
-            sheet_name = def_section['result_separation_sheet'] + f"(iter-{i})"
-            df_sep.to_excel(writer, sheet_name=sheet_name, index=False)
-        #writer.save()
-
-
-def main():
-    order_df, schedule_df, date_df, order_type = get_tables()
-    result_table = pd.DataFrame()
-    result_table_with_separation = pd.DataFrame()
-    index_week, index_date = None, None
-    for index, row in schedule_df.iterrows():
-
-        if index_date is None:
-            index_week, index_date = get_index_week(row, date_df)
-
-        res_df, res_df_with_separation = get_record(row, order_df, index_week, index_date)
-        result_table = result_table.append(res_df.copy())
-        result_table_with_separation = result_table_with_separation.append(res_df_with_separation.copy())
-
-    write_to_file(result_table, result_table_with_separation, order_type)
+    def_section = read_config(conf_file)
+    splitter = IterationSplitter(order_types)
+    with writers.get_result_writer(def_section) as writer:
+        writer.write_frame(def_section['result_sheet'], df_)
+        with metrics.stage('split_into_iterations'):
+            write_separation(writer, splitter, df_separation[SEPARATION_COLUMNS].itertuples(index=False, name=None),
+                             def_section)
+        close_result(writer, splitter, def_section)
+
+
+# состояние процесса-исполнителя при параллельном анализе (см. plan_records)
+_worker_state = None
+
+
+def _init_worker(order_index, calendar, conf_file, timed):
+    """ Инициализация процесса-исполнителя: индекс заказов передается в процесс один раз, а не с каждой задачей"""
+    global _worker_state
+    # замеры по деталям возвращаются вместе с результатом, собирает их основной процесс
+    metrics.disable()
+    _worker_state = (order_index, calendar, conf_file, timed)
+
+
+def _plan_chunk(chunk):
+    """ Анализ группы строк планирования в процессе-исполнителе"""
+    order_index, calendar, conf_file, timed = _worker_state
+    result = []
+    for engine_id, differences in chunk:
+        stats = {} if timed else None
+        result.append(get_record_rows(engine_id, differences, order_index, calendar, conf_file, stats) + (stats, ))
+    return result
+
+
+def _plan_part(tables, engine_id, differences, conf_file):
+    """ Анализ одной строки планирования в текущем процессе (с замерами, если они включены)"""
+    if not metrics.enabled():
+        return get_record_rows(engine_id, differences, tables.order_index, tables.calendar, conf_file)
+    stats = {}
+    result = get_record_rows(engine_id, differences, tables.order_index, tables.calendar, conf_file, stats)
+    metrics.add_part(engine_id, stats)
+    return result
+
+
+def _record_executor(tables, workers, conf_file, mp_context=None):
+    """ Пул процессов для анализа строк через Record: индекс заказов и календарь передаются в процесс один раз"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                               initargs=(tables.order_index, tables.calendar, conf_file, metrics.enabled()))
+
+
+def _plan_with_record(tables, parts, workers, conf_file, mp_context=None, executor=None):
+    """ Анализ строк планирования через Record (см. plan_records)"""
+    if not workers:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(parts) < 2:
+        for engine_id, differences in parts:
+            yield _plan_part(tables, engine_id, differences, conf_file)
+        return
+
+    # несколько групп на процесс, чтобы процессы не простаивали на группах с "тяжелыми" деталями
+    chunksize = max(1, len(parts) // (workers * 8))
+    chunks = [parts[i:i + chunksize] for i in range(0, len(parts), chunksize)]
+    pool = nullcontext(executor) if executor is not None else _record_executor(tables, workers, conf_file, mp_context)
+    with pool as executor:
+        for chunk, chunk_result in zip(chunks, executor.map(_plan_chunk, chunks)):
+            for (engine_id, _), (transfers, separations, stats) in zip(chunk, chunk_result):
+                if stats is not None:
+                    metrics.add_part(engine_id, stats)
+                yield transfers, separations
+
+
+def plan_records(tables, workers=1, conf_file='config.ini', parts=None, engine='record', mp_context=None,
+                 executor=None):
+    """ Анализ всех строк планирования
+
+    При workers > 1 строки делятся на группы, которые обрабатываются в отдельных процессах. Результаты
+    возвращаются в порядке строк таблицы планирования, поэтому совпадают с последовательным анализом.
+
+    :param tables: стартовые таблицы (см. get_tables)
+    :param workers: количество процессов (0 - по числу ядер, 1 - без распараллеливания)
+    :param conf_file: имя конфиг файла
+    :param parts: список пар (ID_125, строка несостыковок) для анализа (по умолчанию - все строки планирования)
+    :param engine: record - каждая строка анализируется через Record, batch - строки, которые это позволяют,
+                   анализируются пакетно (см. модуль batch), а остальные - через Record
+    :param mp_context: контекст multiprocessing для процессов-исполнителей (None - способ запуска по умолчанию;
+                       сервис запускает их через forkserver, см. модуль service)
+    :param executor: готовый пул процессов с тем же индексом заказов и календарем (см. plan_chunks); None - пул
+                     создается на этот вызов
+    :return: генератор пар списков записей (см. get_record_rows) для каждой строки планирования
+    """
+    differences = None
+    if parts is None:
+        parts = list(zip(tables.schedule_df['ID_125'], tables.differences.tolist()))
+        differences = tables.differences
+    if engine == 'record':
+        yield from _plan_with_record(tables, parts, workers, conf_file, mp_context, executor)
+        return
+    if engine != 'batch':
+        raise Exception(f"Неизвестный способ анализа \'{engine}\': допустимы {', '.join(ENGINES)}.")
+
+    with metrics.stage('plan_batch'):
+        if differences is None:
+            differences = [part_differences for _, part_differences in parts]
+        processed, results = batch.plan_batch([engine_id for engine_id, _ in parts], differences,
+                                              tables.order_arrays, tables.calendar)
+    rest = _plan_with_record(tables, [part for part, done in zip(parts, processed.tolist()) if not done], workers,
+                             conf_file, mp_context, executor)
+    for i, done in enumerate(processed.tolist()):
+        if not done:
+            yield next(rest)
+        else:
+            yield results.get(i, ([], []))
+
+
+def state_salt(tables) -> str:
+    """ Отпечаток общих для всех строк планирования данных - календаря (см. incremental.load_state)"""
+    return incremental.fingerprint(sorted(tables.calendar.index_date.items()))
+
+
+def plan_changed(tables, previous: dict, state: dict, workers=1, conf_file='config.ini', engine='record',
+                 mp_context=None):
+    """ Анализ только изменившихся строк планирования (см. модуль incremental)
+
+    Заново анализируются только строки, у которых изменилась строка несостыковок или заказы детали, для остальных
+    берется результат из previous.
+
+    :param tables: стартовые таблицы (см. get_tables)
+    :param previous: результаты предыдущего анализа {ключ строки: (отпечаток, записи, записи)} (см.
+                     incremental.load_state); должны быть получены с тем же календарем (см. state_salt)
+    :param state: словарь, в который записываются результаты этого анализа в том же виде
+    :param workers: количество процессов (см. plan_records)
+    :param conf_file: имя конфиг файла
+    :param engine: способ анализа (см. plan_records)
+    :param mp_context: контекст multiprocessing (см. plan_records)
+    :return: генератор пар списков записей (см. get_record_rows) для каждой строки планирования; по завершении
+             генератор возвращает количество пересчитанных строк
+    """
+    parts = list(zip(tables.schedule_df['ID_125'], tables.differences.tolist()))
+    keys = incremental.part_keys(engine_id for engine_id, _ in parts)
+    fingerprints = [incremental.fingerprint(engine_id, differences, tables.order_index.get(engine_id))
+                    for engine_id, differences in parts]
+    changed = [i for i, (key, fp) in enumerate(zip(keys, fingerprints))
+               if key not in previous or previous[key][0] != fp]
+    computed = plan_records(tables, workers, conf_file, [parts[i] for i in changed], engine, mp_context)
+
+    changed = set(changed)
+    for i, (key, fp) in enumerate(zip(keys, fingerprints)):
+        if i in changed:
+            transfers, separations = next(computed)
+            state[key] = (fp, transfers, separations)
+        else:
+            state[key] = previous[key]
+            transfers, separations = previous[key][1:]
+        yield transfers, separations
+    return len(changed)
+
+
+def plan_incremental(tables, state_filepath, workers=1, conf_file='config.ini', engine='record', mp_context=None):
+    """ Инкрементальный анализ строк планирования с состоянием в файле (см. plan_changed)
+
+    После анализа файл состояния перезаписывается.
+
+    :param tables: стартовые таблицы (см. get_tables)
+    :param state_filepath: файл состояния
+    :param workers: количество процессов (см. plan_records)
+    :param conf_file: имя конфиг файла
+    :param engine: способ анализа (см. plan_records)
+    :param mp_context: контекст multiprocessing (см. plan_records)
+    :return: генератор пар списков записей (см. get_record_rows) для каждой строки планирования
+    """
+    salt = state_salt(tables)
+    state = {}
+    changed = yield from plan_changed(tables, incremental.load_state(state_filepath, salt), state, workers,
+                                      conf_file, engine, mp_context)
+    incremental.save_state(state_filepath, salt, state)
+    print(f"Инкрементальный анализ: использовано готовых результатов - {len(state) - changed}, "
+          f"пересчитано - {changed}.")
+
+
+def plan_to_writer(tables, writer, def_section, conf_file='config.ini', workers=1, engine='record', state_filepath='',
+                   history_filepath='', mp_context=None):
+    """ Анализ всех строк планирования с записью результата
+
+    Результат пишется по мере анализа деталей, частичные переносы сразу делятся на итерации (см. IterationSplitter).
+    При ошибке запись прерывается (см. writers.ResultWriter.abort).
+
+    :param tables: стартовые таблицы (см. get_tables)
+    :param writer: писатель результата (см. модуль writers)
+    :param def_section: секция конфиг файла - для именования вкладок
+    :param conf_file: имя конфиг файла
+    :param workers: количество процессов (см. plan_records)
+    :param engine: способ анализа (см. plan_records)
+    :param state_filepath: файл состояния для инкрементального анализа (пусто - без него)
+    :param history_filepath: база истории переносов (пусто - история не ведется, см. модуль history)
+    :param mp_context: контекст multiprocessing (см. plan_records)
+    """
+    if state_filepath:
+        records = plan_incremental(tables, state_filepath, workers, conf_file, engine, mp_context)
+    else:
+        records = plan_records(tables, workers, conf_file, engine=engine, mp_context=mp_context)
+    write_records(records, tables.order_type, writer, def_section, history_filepath)
+
+
+def write_records(records, order_types, writer, def_section, history_filepath=''):
+    """ Запись результатов анализа по мере их поступления (см. plan_to_writer)
+
+    :param records: итерируемый объект пар списков записей (см. get_record_rows)
+    :param order_types: вн/внутр заказов (см. IterationSplitter)
+    :param writer: писатель результата (см. модуль writers)
+    :param def_section: секция конфиг файла - для именования вкладок
+    :param history_filepath: база истории переносов (пусто - история не ведется). Запуск сохраняется в историю
+                             только после успешной записи результата
+    """
+    splitter = IterationSplitter(order_types)
+    recorder = history.HistoryRecorder(history_filepath) if history_filepath else None
+    try:
+        with metrics.stage('planning'):
+            for transfers, separations in records:
+                writer.write_rows(def_section['result_sheet'], TRANSFER_COLUMNS, transfers)
+                write_separation(writer, splitter, separations, def_section)
+                if recorder is not None:
+                    recorder.add(transfers, separations)
+            if def_section['result_sheet'] not in writer.sheets:
+                writer.write_rows(def_section['result_sheet'], [], [])
+
+        with metrics.stage('write_to_file'):
+            close_result(writer, splitter, def_section)
+    except BaseException:
+        writer.abort()
+        if recorder is not None:
+            recorder.discard()
+        raise
+
+    if recorder is not None:
+        with metrics.stage('history'):
+            recorder.save(def_section['filepath'], def_section['result_filepath'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Распределение изготовления деталей в соответствии с графиком')
+    parser.add_argument('--config', default='config.ini', help='имя конфиг файла')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='количество процессов (0 - по числу ядер); по умолчанию берется из конфиг файла')
+    parser.add_argument('--state', default=None,
+                        help='файл состояния для инкрементального анализа; по умолчанию берется из конфиг файла')
+    parser.add_argument('--metrics', default=None,
+                        help='файл отчета о замерах времени и памяти (.json или .csv); по умолчанию берется из '
+                             'конфиг файла')
+    parser.add_argument('--engine', default=None, choices=ENGINES,
+                        help='способ анализа строк планирования; по умолчанию берется из конфиг файла')
+    parser.add_argument('--history', default=None,
+                        help='база истории переносов (SQLite); по умолчанию берется из конфиг файла')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='количество строк планирования в части для потокового анализа (0 - вся таблица '
+                             'сразу); по умолчанию берется из конфиг файла')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    def_section = read_config(args.config)
+    workers = args.workers if args.workers is not None else def_section.getint('workers', fallback=1)
+    state_filepath = args.state if args.state is not None else def_section.get('state_filepath', fallback='')
+    metrics_filepath = args.metrics if args.metrics is not None else def_section.get('metrics_filepath', fallback='')
+    engine = args.engine if args.engine is not None else def_section.get('engine', fallback='record').strip()
+    if metrics_filepath:
+        metrics.enable(def_section.getint('metrics_top', fallback=20))
+
+    chunk_size = args.chunk_size if args.chunk_size is not None else def_section.getint('chunk_size', fallback=0)
+    history_filepath = args.history if args.history is not None else def_section.get('history_filepath', fallback='')
+
+    if chunk_size > 0 and not state_filepath:
+        # потоковый анализ: таблица планирования читается, проверяется и анализируется частями
+        chunk_tables = iter_chunk_tables(args.config, chunk_size)
+        first = next(chunk_tables)
+        records = plan_chunks(itertools.chain([first], chunk_tables), workers, args.config, engine)
+        write_records(records, first.order_type, writers.get_result_writer(def_section), def_section,
+                      history_filepath)
+    else:
+        with metrics.stage('get_tables'):
+            tables = get_tables(args.config)
+        plan_to_writer(tables, writers.get_result_writer(def_section), def_section, args.config, workers, engine,
+                       state_filepath, history_filepath)
+
+    if metrics_filepath:
+        metrics.write_report(metrics_filepath)
 
 
 if __name__ == "__main__":
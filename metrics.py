@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+""" Замеры времени и памяти этапов анализа
+
+По умолчанию замеры выключены: stage возвращает пустой контекстный менеджер, а данные по деталям не собираются,
+поэтому накладные расходы практически нулевые. После enable для каждого этапа запоминаются время и пиковая память
+(через tracemalloc), а для каждой строки планирования - время анализа и количество перемещений. Отчет записывается
+в json или csv (по расширению файла) и содержит этапы и самые долгие детали.
+"""
+import contextlib
+import csv
+import json
+import time
+import tracemalloc
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class Metrics:
+
+    def __init__(self, top=20):
+        self.top = top          # сколько самых долгих деталей попадет в отчет
+        self.stages = []        # [{'name', 'seconds', 'peak_memory_mb'}, ...] в порядке завершения
+        self.parts = []         # [{'Id_125', 'seconds', 'normalize_seconds', ...}, ...]
+        self._stack = []        # пиковая память открытых этапов (для вложенных этапов)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """ Замер времени и пиковой памяти этапа"""
+        if self._stack:
+            # пик родительского этапа до начала вложенного, т.к. reset_peak его сбросит
+            self._stack[-1] = max(self._stack[-1], tracemalloc.get_traced_memory()[1])
+        self._stack.append(0)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = max(self._stack.pop(), tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                self._stack[-1] = max(self._stack[-1], peak)
+            self.stages.append({'name': name, 'seconds': seconds, 'peak_memory_mb': peak / 2 ** 20})
+
+    def add_part(self, engine_id, stats: dict):
+        """ Данные по одной строке планирования (см. main.get_record)"""
+        self.parts.append(dict(stats, Id_125=engine_id))
+
+    def summary(self) -> dict:
+        slowest = sorted(self.parts, key=lambda part: part['seconds'], reverse=True)[:self.top]
+        totals = {}
+        for part in self.parts:
+            for key, value in part.items():
+                if key != 'Id_125':
+                    totals[key] = totals.get(key, 0) + value
+        return {'stages': self.stages, 'parts': len(self.parts), 'part_totals': totals, 'slowest_parts': slowest}
+
+    def write_report(self, filepath):
+        """ Запись отчета: csv, если имя файла оканчивается на .csv, иначе json"""
+        summary = self.summary()
+        if not filepath.lower().endswith('.csv'):
+            with open(filepath, 'w', encoding='utf8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+            return
+        part_columns = sorted({key for part in summary['slowest_parts'] for key in part} - {'Id_125', 'seconds'})
+        with open(filepath, 'w', encoding='utf8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['kind', 'name', 'seconds', 'peak_memory_mb'] + part_columns)
+            for stage in summary['stages']:
+                writer.writerow(['stage', stage['name'], stage['seconds'], stage['peak_memory_mb']] +
+                                [''] * len(part_columns))
+            for part in summary['slowest_parts']:
+                writer.writerow(['part', part['Id_125'], part['seconds'], ''] +
+                                [part.get(column, '') for column in part_columns])
+
+
+# замеры текущего процесса (None - выключены)
+_metrics = None
+
+
+def enable(top=20) -> Metrics:
+    global _metrics
+    _metrics = Metrics(top)
+    return _metrics
+
+
+def disable():
+    global _metrics
+    if _metrics is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _metrics = None
+
+
+def enabled() -> bool:
+    return _metrics is not None
+
+
+def stage(name: str):
+    """ Контекстный менеджер замера этапа (ничего не делает, если замеры выключены)"""
+    if _metrics is None:
+        return _NULL_CONTEXT
+    return _metrics.stage(name)
+
+
+def add_part(engine_id, stats: dict):
+    if _metrics is not None:
+        _metrics.add_part(engine_id, stats)
+
+
+def write_report(filepath):
+    if _metrics is not None:
+        _metrics.write_report(filepath)
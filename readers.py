@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+""" Чтение стартовых таблиц из разных источников
+
+Источник задается ключами конфиг файла filepath и input_format. Все читатели возвращают "сырые" таблицы заказов,
+планирования и дат в одном и том же виде (заголовок - имена столбцов, значения - как их вернул бы pandas.read_excel),
+а нормализация у всех общая (см. main.read_tables). Поддерживаются форматы:
+    xls, xlsx - рабочая книга, таблицы на вкладках order_sheet, schedule_sheet, date_sheet (над заголовком таблицы
+                заказов две строки, над заголовком таблицы планирования - одна);
+    csv       - каталог, файл <вкладка>.csv на каждую таблицу, заголовок в первой строке (кодировка utf8,
+                разделитель - ключ csv_separator). Читаются только нужные столбцы и с заданными типами;
+    parquet   - каталог, файл <вкладка>.parquet на каждую таблицу (нужен pyarrow), читаются только нужные столбцы;
+    auto      - по расширению файла, а для каталога - по найденному файлу таблицы заказов.
+"""
+import os
+
+import pandas as pd
+
+FORMATS = ('auto', 'xls', 'xlsx', 'csv', 'parquet')
+
+# нужные столбцы таблиц (для csv и parquet, остальные столбцы не читаются)
+ORDER_COLUMNS = ('Id_125', 'План', 'вн/внутр', 'Заказ', 'Дата кон.', 'Наименование')
+SCHEDULE_COLUMNS = ('ID_125', )
+SCHEDULE_PREFIXES = ('Gr', 'Pl')
+DATE_COLUMNS = ('т', 'тт')
+
+# типы столбцов при чтении csv: номера деталей и недель читаются строками и приводятся к числам, как в excel
+# (см. _excel_numbers), даты разбираются отдельно (см. _parse_dates)
+CSV_DTYPES = {
+    'Id_125': 'str', 'План': 'float64', 'вн/внутр': 'str', 'Заказ': 'str', 'Дата кон.': 'str', 'Наименование': 'str',
+    'ID_125': 'str', 'т': 'str', 'тт': 'str',
+}
+CSV_NUMBERS = ('Id_125', 'План', 'ID_125', 'т')
+CSV_MIXED = ('вн/внутр', )
+CSV_DATES = ('Дата кон.', 'тт')
+
+
+def _excel_value(value):
+    # как pandas.read_excel: целые числа, записанные как float, становятся int
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _excel_numbers(values: pd.Series) -> pd.Series:
+    """ Столбец как его вернул бы pandas.read_excel: числа - int64 (если все целые) или float64, иначе как есть"""
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.isna().ne(values.isna()).any():
+        return values
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        return numbers.astype('int64')
+    return numbers.astype('float64')
+
+
+def _excel_mixed(values: pd.Series) -> pd.Series:
+    """ Столбец со строками и числами (как в excel): строки-числа заменяются числами"""
+    numbers = pd.to_numeric(values, errors='coerce')
+    result = values.astype(object)
+    is_number = numbers.notna()
+    result[is_number] = [_excel_value(float(number)) for number in numbers[is_number]]
+    return result
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """ Даты из строк: сначала строго ISO (гггг-мм-дд, как пишет pandas.to_csv), остальные - с днем первым, как в
+    выгрузках (дд.мм.гггг). Строки, которые не удалось разобрать, остаются как есть, чтобы ошибка с ними была выдана
+    при нормализации (см. main.to_dates)"""
+    dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    rest = dates.isna() & values.notna()
+    if rest.any():
+        dates[rest] = pd.to_datetime(values[rest], errors='coerce', dayfirst=True, format='mixed')
+    return dates.astype(object).where(dates.notna(), values)
+
+
+def _needed(column, names=(), prefixes=()) -> bool:
+    column = str(column).strip()
+    return column in names or column.startswith(prefixes)
+
+
+class TableReader:
+    """ Базовый читатель: таблицы заказов, планирования и дат по ключам конфиг файла"""
+
+    def __init__(self, def_section):
+        self.filepath = def_section['filepath']
+        self.order_sheet = def_section['order_sheet']
+        self.schedule_sheet = def_section['schedule_sheet']
+        self.date_sheet = def_section['date_sheet']
+
+    def paths(self) -> list:
+        """ Файлы, из которых читаются таблицы (для ключа кэша, см. main.load_tables)"""
+        return [self.filepath]
+
+    def read(self, schedule=True):
+        """ Чтение таблиц
+
+        :param schedule: читать ли таблицу планирования
+        :return: order_df, schedule_df (None, если schedule=False), date_df
+        """
+        return self.read_orders(), self.read_schedule() if schedule else None, self.read_dates()
+
+    def read_orders(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def read_schedule(self, sheet=None) -> pd.DataFrame:
+        """ Таблица планирования (sheet - другая таблица того же вида, например, вариант графика)"""
+        raise NotImplementedError
+
+    def read_dates(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def iter_schedule(self, chunk_size: int):
+        """ Таблица планирования частями по chunk_size строк (индексы строк сквозные)
+
+        По умолчанию таблица читается целиком и делится на части. Хотя бы одна часть, пусть и пустая, есть всегда.
+        """
+        schedule_df = self.read_schedule()
+        for start in range(0, max(len(schedule_df), 1), chunk_size):
+            yield schedule_df.iloc[start:start + chunk_size]
+
+
+class ExcelReader(TableReader):
+    """ Рабочая книга xls (xlrd) или xlsx (openpyxl)"""
+
+    def read(self, schedule=True):
+        # книга открывается один раз для всех вкладок
+        with pd.ExcelFile(self.filepath) as xl:
+            order_df = xl.parse(self.order_sheet, skiprows=2)
+            schedule_df = xl.parse(self.schedule_sheet, skiprows=1) if schedule else None
+            date_df = xl.parse(self.date_sheet)
+        return order_df, schedule_df, date_df
+
+    def read_orders(self):
+        return pd.read_excel(self.filepath, sheet_name=self.order_sheet, skiprows=2)
+
+    def read_schedule(self, sheet=None):
+        return pd.read_excel(self.filepath, sheet_name=sheet or self.schedule_sheet, skiprows=1)
+
+    def read_dates(self):
+        return pd.read_excel(self.filepath, sheet_name=self.date_sheet)
+
+
+class XlsxReader(ExcelReader):
+    """ Рабочая книга xlsx: таблица планирования по частям читается потоково (openpyxl в режиме read_only)"""
+
+    def iter_schedule(self, chunk_size):
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(self.filepath, read_only=True, data_only=True)
+        try:
+            rows = workbook[self.schedule_sheet].iter_rows(values_only=True)
+            next(rows, None)    # строка над заголовком (skiprows=1)
+            header = next(rows, ())
+            columns = [f'Unnamed: {i}' if column is None else column for i, column in enumerate(header)]
+            width = len(columns)
+            chunk = []
+            start = 0
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                row = [_excel_value(value) for value in row[:width]]
+                chunk.append(row + [None] * (width - len(row)))
+                if len(chunk) == chunk_size:
+                    yield pd.DataFrame(chunk, columns=columns, index=pd.RangeIndex(start, start + len(chunk)))
+                    start += len(chunk)
+                    chunk = []
+            if chunk or not start:
+                yield pd.DataFrame(chunk, columns=columns, index=pd.RangeIndex(start, start + len(chunk)))
+        finally:
+            workbook.close()
+
+
+class CsvReader(TableReader):
+    """ Каталог csv файлов: читаются только нужные столбцы, типы заданы явно (см. CSV_DTYPES)"""
+
+    def __init__(self, def_section):
+        super().__init__(def_section)
+        self.separator = def_section.get('csv_separator', fallback=',') or ','
+
+    def path(self, sheet):
+        return os.path.join(self.filepath, sheet + '.csv')
+
+    def paths(self):
+        return [self.path(sheet) for sheet in (self.order_sheet, self.schedule_sheet, self.date_sheet)]
+
+    def _read(self, path, names=(), prefixes=(), **kwargs):
+        header = pd.read_csv(path, sep=self.separator, encoding='utf-8-sig', nrows=0).columns
+        columns = [column for column in header if _needed(column, names, prefixes)]
+        dtype = {column: CSV_DTYPES.get(column.strip(), 'float64') for column in columns}
+        return pd.read_csv(path, sep=self.separator, encoding='utf-8-sig', usecols=columns, dtype=dtype, **kwargs)
+
+    @staticmethod
+    def _convert(df):
+        for column in df.columns:
+            if column.strip() in CSV_NUMBERS:
+                df[column] = _excel_numbers(df[column])
+            elif column.strip() in CSV_MIXED:
+                df[column] = _excel_mixed(df[column])
+            elif column.strip() in CSV_DATES:
+                df[column] = _parse_dates(df[column])
+        return df
+
+    def read_orders(self):
+        return self._convert(self._read(self.path(self.order_sheet), ORDER_COLUMNS))
+
+    def read_schedule(self, sheet=None):
+        return self.read_schedule_file(self.path(sheet or self.schedule_sheet))
+
+    def read_schedule_file(self, path):
+        """ Таблица планирования из csv файла по пути (например, вариант графика, см. модуль scenarios)"""
+        return self._convert(self._read(path, SCHEDULE_COLUMNS, SCHEDULE_PREFIXES))
+
+    def read_dates(self):
+        return self._convert(self._read(self.path(self.date_sheet), DATE_COLUMNS))
+
+    def iter_schedule(self, chunk_size):
+        chunks = self._read(self.path(self.schedule_sheet), SCHEDULE_COLUMNS, SCHEDULE_PREFIXES,
+                            chunksize=chunk_size)
+        empty = True
+        with chunks:
+            for chunk in chunks:
+                empty = False
+                yield self._convert(chunk)
+        if empty:
+            yield self.read_schedule()
+
+
+class ParquetReader(TableReader):
+    """ Каталог parquet файлов: читаются только нужные столбцы (типы хранятся в самих файлах)"""
+
+    def __init__(self, def_section):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Для чтения таблиц в формате parquet необходим пакет pyarrow.")
+        super().__init__(def_section)
+        self.pq = pyarrow.parquet
+
+    def path(self, sheet):
+        return os.path.join(self.filepath, sheet + '.parquet')
+
+    def paths(self):
+        return [self.path(sheet) for sheet in (self.order_sheet, self.schedule_sheet, self.date_sheet)]
+
+    def _columns(self, path, names=(), prefixes=()):
+        return [column for column in self.pq.read_schema(path).names if _needed(column, names, prefixes)]
+
+    def read_orders(self):
+        path = self.path(self.order_sheet)
+        return pd.read_parquet(path, columns=self._columns(path, ORDER_COLUMNS))
+
+    def read_schedule(self, sheet=None):
+        path = self.path(sheet or self.schedule_sheet)
+        return pd.read_parquet(path, columns=self._columns(path, SCHEDULE_COLUMNS, SCHEDULE_PREFIXES))
+
+    def read_dates(self):
+        path = self.path(self.date_sheet)
+        return pd.read_parquet(path, columns=self._columns(path, DATE_COLUMNS))
+
+    def iter_schedule(self, chunk_size):
+        path = self.path(self.schedule_sheet)
+        parquet_file = self.pq.ParquetFile(path)
+        start = 0
+        for batch in parquet_file.iter_batches(chunk_size, columns=self._columns(path, SCHEDULE_COLUMNS,
+                                                                               SCHEDULE_PREFIXES)):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+        if not start:
+            yield self.read_schedule()
+
+
+def input_format(def_section) -> str:
+    """ Формат источника по ключу input_format (auto - по расширению файла или по файлам каталога)"""
+    value = def_section.get('input_format', fallback='auto').strip().lower() or 'auto'
+    if value not in FORMATS:
+        raise Exception(f"Неизвестный формат входных данных \'{value}\': допустимы {', '.join(FORMATS)}.")
+    if value != 'auto':
+        return value
+    filepath = def_section['filepath']
+    if os.path.isdir(filepath):
+        for extension in ('csv', 'parquet'):
+            if os.path.exists(os.path.join(filepath, f"{def_section['order_sheet']}.{extension}")):
+                return extension
+        raise Exception(f"В каталоге {filepath} нет файла таблицы заказов ({def_section['order_sheet']}.csv или "
+                        f"{def_section['order_sheet']}.parquet).")
+    return 'xlsx' if filepath.lower().endswith(('.xlsx', '.xlsm')) else 'xls'
+
+
+def get_reader(def_section) -> TableReader:
+    """ Читатель стартовых таблиц по ключам конфиг файла input_format и filepath"""
+    return {'xls': ExcelReader, 'xlsx': XlsxReader, 'csv': CsvReader,
+            'parquet': ParquetReader}[input_format(def_section)](def_section)
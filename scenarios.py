@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+""" Сравнение вариантов графика (what-if) на одной книге заказов
+
+Заказы, даты и индекс заказов разбираются один раз (см. main.get_tables), после чего каждый вариант графика -
+таблица того же вида, что вкладка планирования (ID_125, Gr*, Pl*), - анализируется против общего индекса заказов.
+Варианты берутся с дополнительных вкладок той же книги (--sheets) или из csv файлов (--csv); первым всегда идет
+график из самой книги (вкладка schedule_sheet конфиг файла). Варианты обрабатываются параллельно в нескольких
+процессах, индекс заказов передается в процесс один раз.
+
+Для каждого варианта считается сводка, по которой варианты удобно ранжировать:
+    moved_units    - сколько двигателей перенесено (всего по обеим таблицам результата);
+    transfers      - переносов заказа целиком, separations - переносов части заказа;
+    split_orders   - сколько заказов переносится по частям, iterations - количество итераций разделения;
+    late_transfers - переносов на более позднюю дату (переносы вправо), late_units - двигателей в них;
+    parts          - строк планирования, в которых есть переносы.
+
+Пример:
+    python scenarios.py --config config.ini --sheets ориг2 ориг3 --csv variant.csv --workers 4 -o scenarios.xlsx
+"""
+import argparse
+import configparser
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import batch
+import main
+import metrics
+import readers
+import writers
+
+SUMMARY_COLUMNS = ['scenario', 'moved_units', 'transfers', 'separations', 'split_orders', 'iterations',
+                   'late_transfers', 'late_units', 'parts', 'seconds', 'error']
+
+
+def read_scenario(def_section, source) -> pd.DataFrame:
+    """ Таблица планирования варианта (пустоты заполнены нулями, пробелы в именах столбцов обрезаны)
+
+    :param def_section: секция конфиг файла
+    :param source: пара (вид, имя): ('sheet', имя вкладки источника таблиц, см. модуль readers) или
+                   ('csv', путь к файлу; читается как таблица планирования каталога csv - с разделителем
+                   csv_separator и заданными типами, см. readers.CsvReader)
+    """
+    kind, name = source
+    if kind == 'csv':
+        schedule_df = readers.CsvReader(def_section).read_schedule_file(name)
+    else:
+        schedule_df = readers.get_reader(def_section).read_schedule(name)
+    schedule_df = schedule_df.fillna(0)
+    return schedule_df.rename(columns=lambda column: column.strip())
+
+
+def scenario_tables(tables, schedule_df, date_sheet):
+    """ Стартовые таблицы с графиком варианта
+
+    Индекс заказов (и массивы заказов, см. batch.order_arrays) берется общий. Он строится заново, только если недели варианта не совпадают с неделями книги.
+    """
+    calendar = main.Calendar(schedule_df.columns, tables.date_df)
+    differences = main.get_differences(schedule_df, calendar.index_week)
+    main.check_schedule_table(schedule_df, differences)
+    calendar.check_orders(tables.order_df, schedule_df['ID_125'], date_sheet)
+    order_index, order_arrays = tables.order_index, tables.order_arrays
+    if calendar.index_date != tables.calendar.index_date:
+        order_index = main.get_order_index(tables.order_df, calendar.index_date)
+        order_arrays = batch.order_arrays(tables.order_df, calendar.index_date)
+    return tables._replace(schedule_df=schedule_df, differences=differences, calendar=calendar,
+                           order_index=order_index, order_arrays=order_arrays)
+
+
+def summarize(records, order_types) -> dict:
+    """ Сводка по результатам анализа варианта (см. описание модуля)
+
+    :param records: пары списков записей для каждой строки планирования (см. main.plan_records)
+    :param order_types: вн/внутр заказов (для разделения на итерации, см. main.IterationSplitter)
+    """
+    summary = dict.fromkeys(SUMMARY_COLUMNS[1:-2], 0)
+    splitter = main.IterationSplitter(order_types)
+    split_orders = set()
+    for transfers, separations in records:
+        summary['parts'] += bool(transfers or separations)
+        summary['transfers'] += len(transfers)
+        summary['separations'] += len(separations)
+        for _, plan, _, _, date_from, date_to in transfers:
+            summary['moved_units'] += plan
+            if date_to > date_from:
+                summary['late_transfers'] += 1
+                summary['late_units'] += plan
+        for engine_id, order_name, _, date_from, number, date_to in separations:
+            summary['moved_units'] += number
+            split_orders.add((engine_id, order_name))
+            if date_to > date_from:
+                summary['late_transfers'] += 1
+                summary['late_units'] += number
+        splitter.split(separations)
+    summary['split_orders'] = len(split_orders)
+    summary['iterations'] = splitter.iterations
+    return summary
+
+
+def evaluate(tables, name, schedule_df=None, source=None, def_section=None, conf_file='config.ini',
+             engine='record') -> dict:
+    """ Анализ одного варианта
+
+    :param tables: стартовые таблицы книги (см. main.get_tables)
+    :param name: имя варианта
+    :param schedule_df: таблица планирования варианта (None - прочитать из source, см. read_scenario)
+    :return: сводка (см. summarize); ошибка во входных данных варианта не прерывает сравнение, а попадает в error
+    """
+    start = time.perf_counter()
+    try:
+        if schedule_df is None:
+            schedule_df = read_scenario(def_section, source)
+            variant = scenario_tables(tables, schedule_df, def_section['date_sheet'])
+        else:
+            variant = tables
+        summary = summarize(main.plan_records(variant, 1, conf_file, engine=engine), tables.order_type)
+        summary['error'] = ''
+    except Exception as e:
+        summary = dict.fromkeys(SUMMARY_COLUMNS[1:-2], None)
+        summary['error'] = str(e)
+    summary['scenario'] = name
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+# состояние процесса-исполнителя при параллельном анализе вариантов (см. run_scenarios)
+_worker_state = None
+
+
+def _init_worker(tables, def_section, conf_file, engine):
+    """ Инициализация процесса-исполнителя: общие таблицы передаются в процесс один раз"""
+    global _worker_state
+    metrics.disable()
+    # секция передается словарем, читателям таблиц нужна секция конфиг файла (get с fallback)
+    config = configparser.ConfigParser()
+    config.read_dict({'DEFAULT': def_section})
+    _worker_state = (tables, config['DEFAULT'], conf_file, engine)
+
+
+def _evaluate_source(args):
+    tables, def_section, conf_file, engine = _worker_state
+    name, source = args
+    return evaluate(tables, name, source=source, def_section=def_section, conf_file=conf_file, engine=engine)
+
+
+def run_scenarios(conf_file='config.ini', sheets=(), csv_files=(), workers=1, engine='record') -> pd.DataFrame:
+    """ Анализ графика книги и всех вариантов
+
+    :param conf_file: имя конфиг файла
+    :param sheets: вкладки книги с вариантами графика
+    :param csv_files: csv файлы с вариантами графика
+    :param workers: количество процессов (0 - по числу ядер)
+    :param engine: способ анализа (см. main.plan_records)
+    :return: сводка по вариантам в порядке их перечисления (столбцы SUMMARY_COLUMNS)
+    """
+    def_section = main.read_config(conf_file)
+    tables = main.get_tables(conf_file)
+    sources = [(sheet, ('sheet', sheet)) for sheet in sheets]
+    sources += [(os.path.splitext(os.path.basename(path))[0], ('csv', path)) for path in csv_files]
+
+    summaries = [evaluate(tables, def_section['schedule_sheet'], tables.schedule_df, conf_file=conf_file,
+                          engine=engine)]
+    if not workers:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(sources) < 2:
+        summaries += [evaluate(tables, name, source=source, def_section=def_section, conf_file=conf_file,
+                               engine=engine) for name, source in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sources)), initializer=_init_worker,
+                                 initargs=(tables, dict(def_section), conf_file, engine)) as executor:
+            summaries += list(executor.map(_evaluate_source, sources))
+    # счетчики - целые с пропусками для вариантов с ошибкой
+    return pd.DataFrame(summaries, columns=SUMMARY_COLUMNS).astype(dict.fromkeys(SUMMARY_COLUMNS[1:-2], 'Int64'))
+
+
+def write_summary(summary_df, filepath):
+    """ Запись сводки: csv или json по расширению файла, иначе xlsx"""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        summary_df.to_csv(filepath, index=False)
+    elif extension == '.json':
+        with open(filepath, 'w', encoding='utf8') as f:
+            json.dump(summary_df.to_dict(orient='records'), f, ensure_ascii=False, indent=2, default=str)
+    else:
+        with writers.ExcelResultWriter(filepath) as writer:
+            writer.write_frame('scenarios', summary_df)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение вариантов графика на одной книге заказов")
+    parser.add_argument('--config', default='config.ini', help="имя конфиг файла")
+    parser.add_argument('--sheets', nargs='*', default=[], help="вкладки книги с вариантами графика")
+    parser.add_argument('--csv', nargs='*', default=[], help="csv файлы с вариантами графика")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="количество процессов (по умолчанию - ключ workers конфиг файла, 0 - по числу ядер)")
+    parser.add_argument('--engine', choices=main.ENGINES, default=None,
+                        help="способ анализа строк (по умолчанию - ключ engine конфиг файла)")
+    parser.add_argument('--sort', default='moved_units', choices=SUMMARY_COLUMNS, help="столбец для ранжирования")
+    parser.add_argument('-o', '--output', default='', help="файл сводки (.xlsx, .csv или .json)")
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    def_section = main.read_config(args.config)
+    workers = args.workers if args.workers is not None else def_section.getint('workers', fallback=1)
+    engine = args.engine if args.engine is not None else def_section.get('engine', fallback='record').strip()
+    summary_df = run_scenarios(args.config, args.sheets, args.csv, workers, engine)
+    summary_df = summary_df.sort_values(args.sort, kind='stable', na_position='last')
+    print(summary_df.to_string(index=False))
+    if args.output:
+        write_summary(summary_df, args.output)
+
+
+if __name__ == "__main__":
+    run()
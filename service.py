@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+""" Сервис планирования с прогретым кэшем
+
+Процесс запускается один раз и держит в памяти конфиг файлы и разобранные книги вместе с индексами заказов
+(см. main.get_tables), поэтому повторный запрос на той же книге не платит ни за импорт pandas, ни за чтение файла.
+Кэш таблиц - LRU, ограниченный по памяти (размер записи оценивается по памяти таблиц pandas и индекса заказов,
+см. tables_size). Запись привязана к
+содержимому книги и именам вкладок: если файл изменился, он будет прочитан заново.
+
+Запросы обрабатываются пулом потоков (--workers), каждый запрос может дополнительно анализировать строки в нескольких
+процессах (параметр workers запроса, см. main.plan_records). Такие процессы запускаются через forkserver (где его
+нет - через spawn), а не fork: fork из многопоточного сервера может унаследовать захваченные другими потоками
+блокировки. Пути в конфиг файлах отсчитываются от рабочего каталога
+сервиса.
+
+API (HTTP, json):
+    POST /plan   {"config": "config.ini", "workers": 1, "engine": "record", "state_filepath": "",
+                  "result_filepath": "...", "result_format": "xlsx", "inline": false}
+                 Обязателен только config, остальные параметры заменяют ключи конфиг файла. При "inline": true
+                 результат не пишется на диск, а возвращается в ответе: {"tables": {вкладка: {"columns", "rows"}}}.
+                 Иначе возвращаются путь к результату и количество строк на вкладках.
+    GET /status  состояние кэша таблиц
+При ошибке возвращается {"error": текст ошибки}.
+
+Пример:
+    python service.py --port 8765 --workers 4 --cache-mb 2048
+    python service.py --socket /tmp/planning.sock
+"""
+import argparse
+import configparser
+import http.server
+import json
+import multiprocessing
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import main
+import readers
+import writers
+
+# ключи конфиг файла, которые можно заменить в запросе
+REQUEST_KEYS = ('workers', 'engine', 'state_filepath', 'result_filepath', 'result_format', 'history_filepath')
+
+
+def tables_size(tables) -> int:
+    """ Оценка памяти стартовых таблиц (см. main.get_tables) без их сериализации
+
+    Таблицы pandas считаются по memory_usage(deep=True), индекс заказов - по размеру массивов и кортежей, массивы
+    заказов (см. batch.order_arrays) - по nbytes (имена заказов - ссылки на строки таблицы заказов и уже посчитаны).
+    """
+    size = sum(int(df.memory_usage(index=True, deep=True).sum())
+               for df in (tables.order_df, tables.schedule_df, tables.date_df))
+    size += tables.differences.nbytes + sys.getsizeof(tables.order_type) + sys.getsizeof(tables.order_index)
+    for part_orders in tables.order_index.values():
+        size += sys.getsizeof(part_orders) + sum(sys.getsizeof(field) for field in part_orders[:4])
+    size += tables.order_arrays.engines.memory_usage(deep=True)
+    size += sum(array.nbytes for array in tables.order_arrays[1:] if array is not None)
+    return size
+
+
+class TablesCache:
+    """ LRU кэш стартовых таблиц, ограниченный суммарным размером записей"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()  # ключ -> (таблицы, размер)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.loading = {}           # ключ -> блокировка загрузки (одну книгу читает только один поток)
+
+    def get(self, key, load):
+        """ Таблицы по ключу; при промахе они загружаются функцией load
+
+        :return: пара (таблицы, True - если взяты из кэша)
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0], True
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.items:
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return self.items[key][0], True
+            try:
+                tables = load()
+                size = tables_size(tables)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            with self.lock:
+                self.misses += 1
+                self.items[key] = (tables, size)
+                self.size += size
+                self.evict()
+        return tables, False
+
+    def evict(self):
+        """ Вытеснение записей, которые дольше всего не использовались (последняя запись не вытесняется)"""
+        while self.size > self.max_size and len(self.items) > 1:
+            _, (_, size) = self.items.popitem(last=False)
+            self.size -= size
+
+    def status(self) -> dict:
+        with self.lock:
+            return {'entries': len(self.items), 'size_mb': self.size / 2 ** 20,
+                    'max_size_mb': self.max_size / 2 ** 20, 'hits': self.hits, 'misses': self.misses}
+
+
+class PlanningService:
+
+    def __init__(self, workers=2, cache_size=512 * 2 ** 20):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # процессы для анализа строк (параметр workers запроса) запускаются без fork (см. описание модуля)
+        methods = multiprocessing.get_all_start_methods()
+        self.mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.tables = TablesCache(cache_size)
+        self.lock = threading.Lock()
+        self.configs = {}    # путь к конфиг файлу -> (время изменения, ключи секции DEFAULT)
+        self.file_keys = {}  # ((путь, время изменения, размер) файлов, вкладки) -> ключ кэша таблиц
+
+    def read_config(self, conf_file, overrides: dict):
+        """ Секция DEFAULT конфиг файла (из памяти, если файл не менялся) с заменой ключей из запроса"""
+        path = os.path.abspath(conf_file)
+        if not os.path.isfile(path):
+            raise Exception(f"Конфиг файл \'{conf_file}\' не найден.")
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            entry = self.configs.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, dict(main.read_config(conf_file)))
+            with self.lock:
+                self.configs[path] = entry
+        config = configparser.ConfigParser()
+        config.read_dict({'DEFAULT': dict(entry[1], **{key: str(value) for key, value in overrides.items()})})
+        return config['DEFAULT']
+
+    def tables_key(self, def_section) -> str:
+        """ Ключ кэша таблиц; хэш содержимого файлов пересчитывается, только если изменились их время или размер"""
+        paths = [os.path.abspath(path) for path in readers.get_reader(def_section).paths()]
+        stats = [os.stat(path) for path in paths]
+        sheets = (def_section['order_sheet'], def_section['schedule_sheet'], def_section['date_sheet'])
+        file_key = (tuple((path, stat.st_mtime_ns, stat.st_size) for path, stat in zip(paths, stats)), sheets)
+        with self.lock:
+            key = self.file_keys.get(file_key)
+        if key is None:
+            key = cache.cache_key(paths, *sheets)
+            with self.lock:
+                self.file_keys[file_key] = key
+        return key
+
+    def plan(self, request: dict) -> dict:
+        """ Обработка запроса /plan (см. описание модуля)"""
+        start = time.perf_counter()
+        conf_file = request.get('config')
+        if not conf_file:
+            raise Exception("В запросе не указан конфиг файл (config).")
+        def_section = self.read_config(conf_file, {key: request[key] for key in REQUEST_KEYS if key in request})
+        tables, cached = self.tables.get(self.tables_key(def_section), lambda: main.get_tables(conf_file))
+
+        inline = bool(request.get('inline', False))
+        writer = writers.MemoryResultWriter() if inline else writers.get_result_writer(def_section)
+        main.plan_to_writer(tables, writer, def_section, conf_file, def_section.getint('workers', fallback=1),
+                            def_section.get('engine', fallback='record').strip(),
+                            def_section.get('state_filepath', fallback=''),
+                            '' if inline else def_section.get('history_filepath', fallback=''), self.mp_context)
+
+        response = {'cached': cached, 'seconds': time.perf_counter() - start}
+        if inline:
+            response['tables'] = writer.tables()
+        else:
+            response['result_filepath'] = def_section['result_filepath']
+            response['rows'] = dict(writer.row_counts)
+        return response
+
+    def status(self) -> dict:
+        return {'tables': self.tables.status()}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'PlanningService/1.0'
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.send_json(404, {'error': f"Неизвестный адрес {self.path}."})
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        if self.path != '/plan':
+            return self.send_json(404, {'error': f"Неизвестный адрес {self.path}."})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError
+        except ValueError:
+            return self.send_json(400, {'error': "Тело запроса должно быть json объектом."})
+        try:
+            response = self.server.service.pool.submit(self.server.service.plan, request).result()
+        except Exception as e:
+            return self.send_json(500, {'error': str(e)})
+        self.send_json(200, response)
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # у Unix сокета нет адреса клиента
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def remove_socket(socket_path):
+    """ Удаление Unix сокета, оставшегося от прошлого запуска; другие файлы по этому пути не удаляются"""
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise Exception(f"{socket_path} существует и не является Unix сокетом, сервис не будет его удалять")
+    os.remove(socket_path)
+
+
+def make_server(service, host='127.0.0.1', port=8765, socket_path=''):
+    """ HTTP сервер на TCP порту или на Unix сокете (если задан socket_path)"""
+    if socket_path:
+        remove_socket(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис планирования с кэшем разобранных книг в памяти")
+    parser.add_argument('--host', default='127.0.0.1', help="адрес для HTTP")
+    parser.add_argument('--port', type=int, default=8765, help="порт для HTTP")
+    parser.add_argument('--socket', default='', help="путь к Unix сокету (вместо HTTP порта)")
+    parser.add_argument('--workers', type=int, default=2, help="количество одновременно обрабатываемых запросов")
+    parser.add_argument('--cache-mb', type=int, default=512, help="максимальный размер кэша таблиц в мегабайтах")
+    return parser.parse_args(argv)
+
+
+def serve(argv=None):
+    args = parse_args(argv)
+    service = PlanningService(args.workers, args.cache_mb * 2 ** 20)
+    server = make_server(service, args.host, args.port, args.socket)
+    print(f"Сервис планирования: {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket:
+            remove_socket(args.socket)
+
+
+if __name__ == "__main__":
+    serve()
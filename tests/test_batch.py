@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+""" Сравнение пакетного анализа (модуль batch) с Record на сгенерированных книгах"""
+import pytest
+
+import batch
+import generate
+import main
+
+
+@pytest.mark.parametrize('parts, orders_per_part, weeks, drift, seed', [
+    (200, 3, 10, 0.2, 0),
+    (300, 6, 8, 0.6, 1),
+    (100, 2, 30, 0.9, 2),
+])
+def test_batch_matches_record(tmp_path, parts, orders_per_part, weeks, drift, seed):
+    order_df, schedule_df, date_df = generate.generate_tables(parts, orders_per_part, weeks, drift, seed)
+    filepath = str(tmp_path / 'book.xlsx')
+    conf_file = str(tmp_path / 'config.ini')
+    generate.write_workbook(filepath, order_df, schedule_df, date_df)
+    generate.write_config(conf_file, filepath, str(tmp_path / 'result.xlsx'))
+    tables = main.get_tables(conf_file)
+
+    engine_ids = tables.schedule_df['ID_125'].tolist()
+    processed, results = batch.plan_batch(engine_ids, tables.differences, tables.order_arrays, tables.calendar)
+    for i, (engine_id, differences) in enumerate(zip(engine_ids, tables.differences.tolist())):
+        if processed[i]:
+            expected = main.get_record_rows(engine_id, differences, tables.order_index, tables.calendar, conf_file)
+            assert results.get(i, ([], [])) == expected, (engine_id, differences)
+    # переносы в обе стороны, в том числе через несколько недель, обрабатываются пакетно
+    assert processed.mean() > 0.9
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+""" Чтение одних и тех же таблиц из книги xlsx и из каталога csv"""
+import generate
+import main
+
+
+def test_csv_iso_dates_match_xlsx(tmp_path):
+    # даты первых недель (4 января, 11 января) при чтении с днем первым превратились бы в 1 апреля, 1 ноября
+    order_df, schedule_df, date_df = generate.generate_tables(200, 4, 12, 0.3, 0)
+    book = str(tmp_path / 'book.xlsx')
+    generate.write_workbook(book, order_df, schedule_df, date_df)
+    generate.write_config(str(tmp_path / 'xlsx.ini'), book, str(tmp_path / 'xlsx_result.xlsx'))
+
+    # pandas пишет даты в csv в виде ISO (гггг-мм-дд)
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    for sheet, df in ((generate.ORDER_SHEET, order_df), (generate.SCHEDULE_SHEET, schedule_df),
+                      (generate.DATE_SHEET, date_df)):
+        df.to_csv(csv_dir / f'{sheet}.csv', index=False)
+    generate.write_config(str(tmp_path / 'csv.ini'), str(csv_dir), str(tmp_path / 'csv_result.xlsx'))
+
+    expected = main.get_tables(str(tmp_path / 'xlsx.ini'))
+    tables = main.get_tables(str(tmp_path / 'csv.ini'))
+    assert tables.order_df['datetime'].tolist() == expected.order_df['datetime'].tolist()
+    assert tables.calendar.index_date == expected.calendar.index_date
+    assert (tables.differences == expected.differences).all()
+    assert list(main.plan_records(tables, 1, str(tmp_path / 'csv.ini'))) == \
+        list(main.plan_records(expected, 1, str(tmp_path / 'xlsx.ini')))
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+""" Сравнение Record с исходной реализацией на случайных строках планирования
+
+BaselineRecord - замороженная копия Record.normalize/mark_transition из первой версии программы (журналы в
+pandas.DataFrame, ключи заказов (num1, num2, k), сортировка недели после каждого переноса). Изменено только то, чего
+нет в текущем pandas: DataFrame.append заменен на _append (pd.concat), int(Series) - на int(Series.iloc[0]).
+"""
+import array
+import datetime
+import random
+import re
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+import main
+
+
+def _append(df, data: dict):
+    row = pd.DataFrame([data], columns=df.columns)
+    if df.empty:
+        return row.astype(object)
+    return pd.concat([df, row], ignore_index=True)
+
+
+class BaselineRecord:
+
+    def __init__(self, engine_id, differences: list, orders: list, index_date: dict, order_dict: dict):
+        if sum(differences) != 0:
+            raise Exception(f"Sum differences != 0: {differences}")
+        self.engine_id = engine_id
+        self.differences = differences
+        for i in range(len(differences)):
+            if differences[i] < 0 and -differences[i] > sum(orders[i].values()):
+                raise Exception(f"План расходится с заказом на детали {engine_id}.")
+        self.orders = [BaselineRecord.sort_orders(week_order) for week_order in orders]
+        self.index_date = index_date    # соответсвие индекса массива определенной дате
+        self.order_dict = order_dict    # то , что было на старте:
+        self.move_to_future = {}
+
+        # табличка для логирования случаев, когда переносим весь заказ
+        columns = ['Id_125', 'План', 'вн/внутр', 'Заказ', 'Дата кон.', 'd+']
+        self.transfers_without_separation = pd.DataFrame(columns=columns)
+        # табличка для логирования случаев, когда переносим часть заказа
+        columns2 = ['Id_125', 'Заказ', 'Всего в заказе', 'Дата кон.', 'План', 'd+']
+        self.transfers_with_separation = pd.DataFrame(columns=columns2)
+
+    @staticmethod
+    def sort_orders(one_week_orders):
+        keys = list(one_week_orders.keys())
+        keys.sort(key=lambda x: (x[0], x[1], x[2]))
+        new_dict = OrderedDict()
+        for k in keys:
+            new_dict[k] = one_week_orders[k]
+        return new_dict
+
+    def move(self, cell_from, cell_to, order_name, quality=None):
+        if not quality or isinstance(quality, int) and quality == self.orders[cell_from][order_name]:
+            quality = self.orders[cell_from].pop(order_name)
+        else:
+            self.orders[cell_from][order_name] -= quality
+        if order_name in self.orders[cell_to]:
+            self.orders[cell_to][order_name] += quality
+        else:
+            self.orders[cell_to][order_name] = quality
+
+        self.orders[cell_to] = BaselineRecord.sort_orders(self.orders[cell_to])
+
+    def move_left(self, cell_from: int, cell_to: int, delta: int):
+        if cell_from <= cell_to:
+            raise Exception(f"Ошибка в порядке перемещения move_left: {cell_from} <= {cell_to}")
+        if sum(self.orders[cell_from].values()) < delta:
+            raise Exception(f"Ошибка в порядке перемещения move_left: delta ({delta}) > "
+                            f"{sum(self.orders[cell_from].values())}")
+        from_local_order = self.orders[cell_from].copy()
+        order_names = from_local_order.keys()
+        for order_name in order_names:
+            if delta >= from_local_order[order_name]:
+                delta -= from_local_order[order_name]
+                self.move(cell_from, cell_to, order_name)
+                t = self.transfers_with_separation[self.transfers_with_separation['Заказ'] == order_name]
+                if not t.empty:
+                    self.mark_transition(order_name, cell_from, cell_to, from_local_order[order_name])
+                else:
+                    self.mark_transition(order_name, cell_from, cell_to)
+                if delta == 0:
+                    break
+            else:
+                self.move(cell_from, cell_to, order_name, delta)
+                self.mark_transition(order_name, cell_from, cell_to, delta)
+                break
+
+    def move_right(self, cell_from: int, cell_to: int, delta: int, quality=None):
+        if cell_from >= cell_to:
+            raise Exception(f"Ошибка в порядке перемещения move_right: {cell_from} >= {cell_to}")
+        from_local_order = BaselineRecord.sort_orders(self.orders[cell_from])
+        order_names = from_local_order.keys()
+        order_names = list(order_names)[::-1]
+        for order_name in order_names:
+            if order_name not in self.move_to_future:
+                self.move_to_future[order_name] = [cell_from, None]
+
+            if delta >= from_local_order[order_name]:
+                delta -= from_local_order[order_name]
+                self.move(cell_from, cell_to, order_name)
+                self.mark_transition(order_name, cell_from, cell_to)
+                if delta == 0:
+                    break
+
+            else:
+                self.move_to_future[order_name][1] = True
+                self.move(cell_from, cell_to, order_name, delta)
+                self.mark_transition(order_name, cell_from, cell_to, delta)
+                break
+
+    def normalize(self):
+        n = len(self.orders)
+        for i in range(n):
+            if self.differences[i] > 0:
+                j = i + 1
+                while self.differences[i] != 0:
+                    if self.orders[j]:
+                        week_sum = sum(self.orders[j].values())
+                        if week_sum >= self.differences[i]:
+                            self.move_left(j, i, self.differences[i])
+                            self.differences[j] += self.differences[i]
+                            self.differences[i] = 0
+                        else:
+                            self.move_left(j, i, week_sum)
+                            self.differences[j] += week_sum
+                            self.differences[i] -= week_sum
+                            j += 1
+                    else:
+                        j += 1
+            elif self.differences[i] < 0:
+                j = i + 1
+                sum_ = sum(self.orders[j].values()) if self.orders[j] else 0
+                quality = min(-self.differences[i], sum_) if sum_ else sum_
+                if self.differences[j] > quality:
+                    quality = self.differences[j]
+                self.move_right(i, j, -self.differences[i], quality)
+                self.differences[j] += self.differences[i]
+                self.differences[i] = 0
+
+    def mark_transition(self, order_name: str, cell_from: int, cell_to: int, quality: int = None):
+        data = {
+            'Id_125': self.engine_id,
+            'План': self.order_dict[order_name][0],
+            'вн/внутр': self.order_dict[order_name][1],
+            'Заказ': order_name,
+            'Дата кон.': self.index_date[cell_from],
+            'd+': self.index_date[cell_to],
+        }
+        without = self.transfers_without_separation
+        if not quality:
+            t = without[(without['Id_125'] == self.engine_id) & (without['План'] == self.order_dict[order_name][0]) &
+                        (without['Заказ'] == order_name) & (without['d+'] == self.index_date[cell_from])]
+            if not t.empty:
+                self.transfers_without_separation.loc[t.index, 'd+'] = self.index_date[cell_to]
+            else:
+                self.transfers_without_separation = _append(self.transfers_without_separation, data.copy())
+        else:
+            del data['вн/внутр']
+            data['План'] = quality
+            data['Всего в заказе'] = self.order_dict[order_name][0]
+            t = without[(without['Id_125'] == self.engine_id) & (without['План'] == self.order_dict[order_name][0]) &
+                        (without['Заказ'] == order_name) & (without['d+'] == self.index_date[cell_from])]
+            if not t.empty:
+                local_data = t.to_dict(orient='records')[0]
+                local_data['План'] = local_data['План'] - data['План']
+                del local_data['вн/внутр']
+                data['План'] = quality
+                local_data['Всего в заказе'] = self.order_dict[order_name][0]
+                self.transfers_without_separation = without.loc[
+                    ~(without['Id_125'] == self.engine_id) | ~(without['План'] == self.order_dict[order_name][0]) |
+                    ~(without['Заказ'] == order_name) | ~(without['d+'] == self.index_date[cell_from])
+                ]
+                self.transfers_with_separation = _append(self.transfers_with_separation, local_data.copy())
+
+                data['Дата кон.'] = local_data['Дата кон.']
+                self.transfers_with_separation = _append(self.transfers_with_separation, data.copy())
+            else:
+                separation = self.transfers_with_separation
+                t = separation[(separation['Id_125'] == self.engine_id) & (separation['Заказ'] == order_name) &
+                               (separation['d+'] == self.index_date[cell_from])]
+                if t.empty:
+                    self.transfers_with_separation = _append(separation, data.copy())
+                elif int(t['План'].iloc[0]) == quality:
+                    self.transfers_with_separation.loc[t.index, 'd+'] = self.index_date[cell_to]
+                else:
+                    local_delta = separation['План'] - quality
+                    data['Дата кон.'] = t.to_dict(orient='records')[0]['Дата кон.']
+                    self.transfers_with_separation.loc[t.index, 'План'] = local_delta
+                    self.transfers_with_separation = _append(self.transfers_with_separation, data.copy())
+
+
+def _rows(df, names) -> list:
+    """ Строки журнала исходной реализации: ключи заказов заменены именами, числа приведены к int"""
+    rows = []
+    for row in df.itertuples(index=False, name=None):
+        rows.append(tuple(names.get(value, value) if isinstance(value, tuple) else
+                          int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+                          for value in row))
+    return rows
+
+
+def random_part(rnd):
+    """ Случайная строка планирования: (несостыковки, [(ключ, неделя, количество, имя, вн/внутр), ...])"""
+    n = rnd.randint(2, 8)
+    orders = []
+    k = 10000
+    for _ in range(rnd.randint(1, 8)):
+        key = (rnd.randint(1, 3), rnd.randint(0, 2), k)
+        k -= 1
+        # имена из маленького набора, чтобы у детали были заказы с одинаковыми именами; количество бывает нулевым
+        orders.append((key, rnd.randrange(n), rnd.randint(0, 6), f'{rnd.randint(1, 3)}*-A-{rnd.randint(1, 2)}',
+                       rnd.choice([1, 2])))
+    if rnd.random() < 0.2:
+        # произвольные несостыковки - в том числе неверные, на которых обе реализации выдают ошибку
+        differences = [rnd.randint(-6, 6) for _ in range(n)]
+        differences[-1] -= sum(differences)
+        return differences, orders
+    # график - план со сдвигом части двигателей на соседние недели в обе стороны
+    plan = [0] * n
+    for _, week, quantity, _, _ in orders:
+        plan[week] += quantity
+    schedule = plan[:]
+    for _ in range(rnd.randint(1, 6)):
+        week = rnd.randrange(n)
+        target = week + rnd.choice([-2, -1, 1, 2])
+        if schedule[week] and 0 <= target < n:
+            schedule[week] -= 1
+            schedule[target] += 1
+    return [gr - pl for gr, pl in zip(schedule, plan)], orders
+
+
+def run_baseline(differences, orders, dates):
+    week_orders = [{} for _ in differences]
+    for key, week, plan, _, _ in orders:
+        week_orders[week][key] = plan
+    order_dict = {key: [plan, feature] for key, _, plan, _, feature in orders}
+    names = {key: name for key, _, _, name, _ in orders}
+    record = BaselineRecord(1, list(differences), week_orders, dict(enumerate(dates)), order_dict)
+    record.normalize()
+    return _rows(record.transfers_without_separation, names), _rows(record.transfers_with_separation, names)
+
+
+def run_current(differences, orders, dates):
+    orders = sorted(orders)
+    part_orders = main.PartOrders(array.array('l', [week for _, week, _, _, _ in orders]),
+                                  array.array('q', [plan for _, _, plan, _, _ in orders]),
+                                  tuple(name for _, _, _, name, _ in orders),
+                                  tuple(feature for _, _, _, _, feature in orders), None)
+    record = main.Record(1, list(differences), part_orders, dates)
+    record.normalize()
+    return record.transfer_rows(part_orders.names, part_orders.features)
+
+
+@pytest.mark.parametrize('block', range(10))
+def test_record_matches_baseline(block):
+    compared = 0
+    for seed in range(block * 200, (block + 1) * 200):
+        rnd = random.Random(seed)
+        differences, orders = random_part(rnd)
+        dates = [datetime.date(2019, 1, 4) + datetime.timedelta(days=7 * i) for i in range(len(differences))]
+        try:
+            expected = run_baseline(differences, orders, dates)
+        except Exception as e:
+            with pytest.raises(Exception, match=re.escape(str(e)[:20])):
+                run_current(differences, orders, dates)
+            continue
+        assert run_current(differences, orders, dates) == expected, (seed, differences, orders)
+        compared += 1
+    assert compared > 50
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+""" Режим наблюдения: повторный анализ при изменении входных данных
+
+Процесс запускается один раз, делает анализ и дальше следит за конфиг файлом и файлами источника таблиц (книга
+filepath или файлы каталога, см. модуль readers). Когда файлы изменились и после этого не менялись --debounce секунд
+(планировщик дописал книгу), сравнивается хэш их содержимого с хэшем последнего анализа: если книгу просто
+пересохранили без изменений, то анализ не повторяется.
+
+Между анализами в памяти остаются стартовые таблицы и результаты каждой строки планирования, поэтому заново
+анализируются только строки, у которых изменились несостыковки или заказы детали (см. main.plan_changed), а индекс
+заказов строится заново, только если изменились заказы или недели (см. main.make_tables). Если задан
+state_filepath, то результаты строк при запуске берутся из него и сохраняются в него после каждого анализа.
+
+Результат (result_filepath) перезаписывается атомарно (см. модуль writers): открытый на чтение результат никогда
+не бывает записан наполовину, а при ошибке во входных данных остается предыдущий результат, ошибка выводится, и
+наблюдение продолжается. Потоковый анализ (chunk_size) в этом режиме не используется.
+
+Пример:
+    python watch.py --config config.ini --interval 1 --debounce 2
+"""
+import argparse
+import datetime
+import os
+import time
+
+import cache
+import incremental
+import main
+import readers
+import writers
+
+
+class Watcher:
+    """ Наблюдение за источником таблиц одного конфиг файла"""
+
+    def __init__(self, conf_file='config.ini', workers=None, engine=None, interval=1.0, debounce=2.0):
+        """
+        :param conf_file: имя конфиг файла
+        :param workers: количество процессов (None - ключ workers конфиг файла, см. main.plan_records)
+        :param engine: способ анализа (None - ключ engine конфиг файла, см. main.plan_records)
+        :param interval: период проверки файлов в секундах
+        :param debounce: сколько секунд файлы не должны меняться перед анализом
+        """
+        self.conf_file = conf_file
+        self.workers = workers
+        self.engine = engine
+        self.interval = interval
+        self.debounce = debounce
+        self.content_key = None     # хэш содержимого файлов последнего успешного анализа
+        self.tables = None          # стартовые таблицы последнего успешного анализа
+        self.salt = None            # отпечаток календаря (см. main.state_salt)
+        self.state = {}             # результаты строк планирования (см. main.plan_changed)
+
+    def paths(self) -> list:
+        """ Наблюдаемые файлы: конфиг файл и файлы источника таблиц"""
+        try:
+            return [self.conf_file] + readers.get_reader(main.read_config(self.conf_file)).paths()
+        except Exception:
+            # ошибка в конфиг файле будет выдана при анализе, а пока следим хотя бы за ним
+            return [self.conf_file]
+
+    def signature(self) -> tuple:
+        """ Время изменения и размер наблюдаемых файлов (None - файла нет)"""
+        result = []
+        for path in self.paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                result.append((path, None))
+            else:
+                result.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(result)
+
+    def wait_for_change(self, signature) -> tuple:
+        """ Ожидание изменения файлов
+
+        :param signature: отпечаток файлов (см. signature), с которым сравнивается текущий
+        :return: новый отпечаток - после того, как файлы изменились и затем не менялись debounce секунд
+        """
+        while True:
+            time.sleep(self.interval)
+            current = self.signature()
+            if current == signature:
+                continue
+            stable_since = time.monotonic()
+            while time.monotonic() - stable_since < self.debounce:
+                time.sleep(min(self.interval, self.debounce))
+                latest = self.signature()
+                if latest != current:
+                    current, stable_since = latest, time.monotonic()
+            return current
+
+    def update(self) -> bool:
+        """ Анализ, если содержимое файлов изменилось с последнего успешного анализа
+
+        :return: True - результат перезаписан, False - содержимое не изменилось
+        """
+        def_section = main.read_config(self.conf_file)
+        paths = self.paths()
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            raise Exception(f"Нет файлов: {', '.join(missing)}.")
+        key = cache.cache_key(paths)
+        if key == self.content_key:
+            return False
+
+        workers = self.workers if self.workers is not None else def_section.getint('workers', fallback=1)
+        engine = self.engine if self.engine is not None else def_section.get('engine', fallback='record').strip()
+        state_filepath = def_section.get('state_filepath', fallback='')
+
+        order_df, schedule_df, date_df = main.load_tables(def_section)
+        tables = main.make_tables(def_section, order_df, schedule_df, date_df, self.tables)
+        salt = main.state_salt(tables)
+        if salt == self.salt:
+            previous = self.state
+        elif state_filepath:
+            previous = incremental.load_state(state_filepath, salt)
+        else:
+            previous = {}
+
+        state = {}
+        records = main.plan_changed(tables, previous, state, workers, self.conf_file, engine)
+        main.write_records(records, tables.order_type, writers.get_result_writer(def_section), def_section,
+                           def_section.get('history_filepath', fallback=''))
+        if state_filepath:
+            incremental.save_state(state_filepath, salt, state)
+
+        changed = sum(previous.get(part_key) is not result for part_key, result in state.items())
+        print(f"{_now()} Результат {def_section['result_filepath']} перезаписан: использовано готовых "
+              f"результатов - {len(state) - changed}, пересчитано - {changed}.")
+        self.content_key, self.tables, self.salt, self.state = key, tables, salt, state
+        return True
+
+    def run(self):
+        """ Анализ и наблюдение до прерывания (Ctrl+C)"""
+        signature = self.signature()
+        while True:
+            start = time.perf_counter()
+            try:
+                if not self.update():
+                    print(f"{_now()} Содержимое файлов не изменилось, анализ не нужен.")
+            except Exception as e:
+                print(f"{_now()} Ошибка: {e} Результат не изменен, ожидаются исправления.")
+            else:
+                print(f"{_now()} Время: {time.perf_counter() - start:.2f} с.")
+            signature = self.wait_for_change(signature)
+
+
+def _now() -> str:
+    return datetime.datetime.now().strftime('%H:%M:%S')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Повторный анализ при изменении входных данных")
+    parser.add_argument('--config', default='config.ini', help="имя конфиг файла")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="количество процессов (по умолчанию - ключ workers конфиг файла, 0 - по числу ядер)")
+    parser.add_argument('--engine', choices=main.ENGINES, default=None,
+                        help="способ анализа строк (по умолчанию - ключ engine конфиг файла)")
+    parser.add_argument('--interval', type=float, default=1.0, help="период проверки файлов в секундах")
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help="сколько секунд файлы не должны меняться перед анализом")
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    watcher = Watcher(args.config, args.workers, args.engine, args.interval, args.debounce)
+    print(f"Наблюдение за {', '.join(watcher.paths())} (Ctrl+C - выход)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
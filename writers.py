@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+""" Потоковая запись результатов
+
+Строки результирующих таблиц передаются писателю по мере анализа деталей и сразу уходят на диск, поэтому память
+не растет с количеством переносов. Поддерживаются форматы:
+    xlsx    - одна книга, вкладка на каждую таблицу. Строки копятся во временных файлах на диске (см. SheetSpool),
+              при закрытии книга записывается xlsxwriter в режиме constant_memory;
+    csv     - каталог, файл <вкладка>.csv на каждую таблицу;
+    parquet - каталог, файл <вкладка>.parquet на каждую таблицу (нужен pyarrow).
+Результат пишется во временный файл (для csv и parquet - в новый каталог) рядом с результатом и заменяет его
+только при успешном завершении записи, поэтому тот, кто читает результат, никогда не видит его записанным
+наполовину или смесь двух запусков, а при ошибке остается предыдущий результат. Временные файлы и каталоги
+создаются обычными open/mkdir, поэтому права у результата - по umask, как при записи напрямую.
+"""
+import csv
+import datetime
+import math
+import numbers
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+
+FORMATS = ('xlsx', 'csv', 'parquet')
+
+
+class SheetSpool:
+    """ Строки одной таблицы во временном файле (пачками через pickle)"""
+
+    def __init__(self, columns: list):
+        self.columns = columns
+        self.file = tempfile.TemporaryFile()
+        self.rows = 0
+
+    def write(self, rows: list):
+        if rows:
+            pickle.dump(rows, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.rows += len(rows)
+
+    def __iter__(self):
+        self.file.seek(0)
+        while True:
+            try:
+                rows = pickle.load(self.file)
+            except EOFError:
+                break
+            yield from rows
+
+    def close(self):
+        self.file.close()
+
+
+class ResultWriter:
+    """ Базовый писатель: таблицы (вкладки) регистрируются при первой записи, порядок регистрации сохраняется"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.sheets = {}    # имя вкладки -> столбцы
+        self.row_counts = {}    # имя вкладки -> количество записанных строк
+        self.closed = False
+
+    def write_rows(self, sheet_name: str, columns: list, rows):
+        """ Дописать строки в таблицу sheet_name
+
+        :param sheet_name: имя вкладки
+        :param columns: столбцы таблицы (заголовок пишется один раз, при первой записи)
+        :param rows: итерируемый объект строк (последовательностей значений в порядке columns)
+        """
+        rows = list(rows)
+        if sheet_name not in self.sheets:
+            self.sheets[sheet_name] = list(columns)
+            self.row_counts[sheet_name] = 0
+            self._open_sheet(sheet_name, self.sheets[sheet_name])
+        self.row_counts[sheet_name] += len(rows)
+        self._write(sheet_name, rows)
+
+    def write_frame(self, sheet_name: str, df):
+        """ Дописать строки pandas.DataFrame в таблицу sheet_name"""
+        self.write_rows(sheet_name, list(df.columns), df.itertuples(index=False, name=None))
+
+    def close(self, sheet_order=None):
+        """ Завершение записи (повторный вызов ничего не делает)
+
+        :param sheet_order: порядок вкладок для форматов с одной книгой (xlsx). Вкладки, которых нет в списке, идут
+                            следом в порядке регистрации, а имена из списка, в которые ничего не записано, пропускаются
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._close(sheet_order)
+        finally:
+            self.close_files()
+
+    def ordered_sheets(self, sheet_order=None) -> list:
+        ordered = [sheet_name for sheet_name in (sheet_order or []) if sheet_name in self.sheets]
+        return list(dict.fromkeys(ordered + list(self.sheets)))
+
+    def abort(self):
+        """ Прерывание записи (при ошибке): временные файлы удаляются, результат не заменяется"""
+        if not self.closed:
+            self.closed = True
+            self.close_files()
+
+    def close_files(self):
+        pass
+
+    def _open_sheet(self, sheet_name, columns):
+        pass
+
+    def _write(self, sheet_name, rows):
+        raise NotImplementedError
+
+    def _close(self, sheet_order):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ExcelResultWriter(ResultWriter):
+
+    def __init__(self, filepath, date_format='dd.mm.yyyy'):
+        super().__init__(filepath)
+        self.date_format = date_format
+        self.spools = {}
+
+    def _open_sheet(self, sheet_name, columns):
+        self.spools[sheet_name] = SheetSpool(columns)
+
+    def _write(self, sheet_name, rows):
+        self.spools[sheet_name].write(rows)
+
+    def _close(self, sheet_order):
+        import xlsxwriter
+
+        # книга пишется во временный файл и заменяет результат только целиком
+        tmp_path = _temp_path(self.filepath, '.xlsx')
+        try:
+            workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True})
+            header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            date_format = workbook.add_format({'num_format': self.date_format})
+            for sheet_name in self.ordered_sheets(sheet_order):
+                columns = self.sheets[sheet_name]
+                worksheet = workbook.add_worksheet(sheet_name)
+                for col, column in enumerate(columns):
+                    worksheet.write_string(0, col, str(column), header_format)
+                for row_number, row in enumerate(self.spools[sheet_name], 1):
+                    for col, value in enumerate(row):
+                        _write_cell(worksheet, row_number, col, value, date_format)
+            workbook.close()
+            os.replace(tmp_path, self.filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close_files(self):
+        for spool in self.spools.values():
+            spool.close()
+
+
+def _write_cell(worksheet, row, col, value, date_format):
+    if value is None:
+        return
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        worksheet.write_datetime(row, col, value, date_format)
+    elif isinstance(value, numbers.Number) and not isinstance(value, bool):
+        if not math.isnan(value):
+            worksheet.write_number(row, col, value)
+    else:
+        worksheet.write_string(row, col, str(value))
+
+
+class DirectoryResultWriter(ResultWriter):
+    """ Каталог с файлом <вкладка><extension> на каждую таблицу
+
+    Файлы пишутся в новый каталог рядом с результатом, который при закрытии целиком встает на место каталога
+    результата (см. _replace_directory), поэтому файлов предыдущего запуска в результате не остается.
+    """
+    extension = ''
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        self.tmp_dir = None
+
+    def sheet_path(self, sheet_name) -> str:
+        """ Файл вкладки во временном каталоге (каталог создается при первом обращении)"""
+        if self.tmp_dir is None:
+            self.tmp_dir = _temp_path(self.filepath)
+            os.mkdir(self.tmp_dir)
+        return os.path.join(self.tmp_dir, sheet_name + self.extension)
+
+    def replace_directory(self):
+        if self.tmp_dir is None:
+            self.sheet_path('')
+        _replace_directory(self.tmp_dir, self.filepath)
+
+    def close_files(self):
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class CsvResultWriter(DirectoryResultWriter):
+    extension = '.csv'
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.files = {}
+
+    def _open_sheet(self, sheet_name, columns):
+        f = open(self.sheet_path(sheet_name), 'w', encoding='utf8', newline='')
+        self.files[sheet_name] = (f, csv.writer(f))
+        self.files[sheet_name][1].writerow(columns)
+
+    def _write(self, sheet_name, rows):
+        self.files[sheet_name][1].writerows(rows)
+
+    def _close(self, sheet_order):
+        for f, _ in self.files.values():
+            f.close()
+        self.replace_directory()
+
+    def close_files(self):
+        for f, _ in self.files.values():
+            f.close()
+        super().close_files()
+
+
+class ParquetResultWriter(DirectoryResultWriter):
+    extension = '.parquet'
+
+    def __init__(self, filepath, batch_size=65536):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Для записи результата в формате parquet необходим пакет pyarrow.")
+        super().__init__(filepath)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.writers = {}   # создаются по первой пачке строк, чтобы определить типы столбцов
+
+    def _open_sheet(self, sheet_name, columns):
+        self.buffers[sheet_name] = []
+
+    def _write(self, sheet_name, rows):
+        buffer = self.buffers[sheet_name]
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            self._flush(sheet_name)
+
+    def _flush(self, sheet_name):
+        buffer = self.buffers[sheet_name]
+        columns = self.sheets[sheet_name]
+        data = {column: [row[i] for row in buffer] for i, column in enumerate(columns)}
+        writer = self.writers.get(sheet_name)
+        if writer is None:
+            table = self.pa.table(data)
+            schema = self.pa.schema([self.pa.field(field.name, self.pa.string())
+                                     if self.pa.types.is_null(field.type) else field for field in table.schema])
+            table = table.cast(schema)
+            writer = self.pq.ParquetWriter(self.sheet_path(sheet_name), schema)
+            self.writers[sheet_name] = writer
+        else:
+            table = self.pa.table(data, schema=writer.schema)
+        writer.write_table(table)
+        buffer.clear()
+
+    def _close(self, sheet_order):
+        for sheet_name in self.sheets:
+            if self.buffers[sheet_name] or sheet_name not in self.writers:
+                self._flush(sheet_name)
+        for writer in self.writers.values():
+            writer.close()
+        self.replace_directory()
+
+    def close_files(self):
+        for writer in self.writers.values():
+            writer.close()
+        super().close_files()
+
+
+def _replace_directory(tmp_dir, path):
+    """ Замена каталога результата path записанным каталогом tmp_dir
+
+    Непустой каталог нельзя заменить через os.replace, поэтому прежний результат сначала переименовывается, на его
+    место встает новый каталог, и только после этого прежний удаляется. Между двумя переименованиями результата нет
+    совсем, но наполовину замененного результата или смеси двух запусков читатель не увидит.
+    """
+    if not os.path.isdir(path):
+        os.replace(tmp_dir, path)
+        return
+    old_dir = _temp_path(path, '.old')
+    os.replace(path, old_dir)
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        os.replace(old_dir, path)
+        raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _temp_path(path, suffix=''):
+    """ Имя временного файла или каталога рядом с path (на той же файловой системе, чтобы заменить path через
+    os.replace)
+
+    Файл (каталог) создает тот, кто в него пишет, обычным open (mkdir), поэтому права у него - как у результата,
+    записанного напрямую (по umask), а не 0600 (0700), как у tempfile.mkstemp (mkdtemp).
+    """
+    dirname, basename = os.path.split(os.path.abspath(path))
+    return os.path.join(dirname, f'.{basename}.{uuid.uuid4().hex}{suffix}')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class MemoryResultWriter(ResultWriter):
+    """ Таблицы в памяти (для ответа сервиса, см. модуль service): filepath не используется"""
+
+    def __init__(self):
+        super().__init__(None)
+        self.rows = {}
+        self.sheet_order = []
+
+    def _open_sheet(self, sheet_name, columns):
+        self.rows[sheet_name] = []
+
+    def _write(self, sheet_name, rows):
+        self.rows[sheet_name].extend(rows)
+
+    def _close(self, sheet_order):
+        self.sheet_order = self.ordered_sheets(sheet_order)
+
+    def tables(self) -> dict:
+        """ {вкладка: {'columns': столбцы, 'rows': строки}} в порядке вкладок"""
+        return {sheet_name: {'columns': self.sheets[sheet_name], 'rows': self.rows[sheet_name]}
+                for sheet_name in self.sheet_order or self.sheets}
+
+
+def get_result_writer(def_section) -> ResultWriter:
+    """ Писатель результата по ключам конфиг файла result_format (xlsx, csv или parquet) и result_filepath"""
+    result_format = def_section.get('result_format', fallback='xlsx').strip().lower() or 'xlsx'
+    filepath = def_section['result_filepath']
+    if result_format == 'xlsx':
+        return ExcelResultWriter(filepath)
+    if result_format == 'csv':
+        return CsvResultWriter(filepath)
+    if result_format == 'parquet':
+        return ParquetResultWriter(filepath)
+    raise Exception(f"Неизвестный формат результата \'{result_format}\': допустимы {', '.join(FORMATS)}.")